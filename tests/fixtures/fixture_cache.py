@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def temporary_caches():
+    # Как TestRunner у manage.py test: cache.clear() в тестах чистит
+    # временный кеш, а не BASE_DIR/cache сервера.
+    from core.testing import temporary_caches
+    with temporary_caches():
+        yield
@@ -0,0 +1,119 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from . import replicas
+
+TAG_VERSION_KEY = 'cache_tag:{}'
+PAGE_KEY = 'page:{}'
+
+
+def get_tag_versions(tags):
+    """
+    Возвращает текущие версии тегов кеша в порядке ``tags``.
+
+    Тегу без версии (новому или вытесненному из кеша) выдаётся свежая
+    случайная версия, так что старые записи с ним не оживают.
+    """
+    keys = [TAG_VERSION_KEY.format(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_tags(*tags):
+    """Делает устаревшими все ответы и фрагменты с этими тегами."""
+    cache.set_many(
+        {TAG_VERSION_KEY.format(tag): uuid.uuid4().hex for tag in tags},
+        None,
+    )
+
+
+def tags_digest(tags):
+    """Короткая строка, меняющаяся при смене версии любого из тегов."""
+    versions = ':'.join(get_tag_versions(tags))
+    return hashlib.md5(versions.encode()).hexdigest()
+
+
+def make_etag(*parts):
+    """ETag из частей состояния страницы."""
+    raw = ':'.join(str(part) for part in parts)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def conditional(get_state):
+    """
+    ``condition`` с одним вычислением состояния на оба заголовка.
+
+    ``get_state(request, *args, **kwargs)`` возвращает пару (ETag,
+    Last-Modified) или ``(None, None)``, если объекта нет: тогда 404
+    отдаёт само представление.
+    """
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_state'):
+            request._conditional_state = get_state(request, *args, **kwargs)
+        return request._conditional_state
+
+    return condition(
+        etag_func=lambda *args, **kwargs: state(*args, **kwargs)[0],
+        last_modified_func=lambda *args, **kwargs: state(*args, **kwargs)[1],
+    )
+
+
+def cache_page_tagged(timeout, get_tags, vary_on_csrf=False):
+    """
+    Кеш страниц, сбрасываемый по тегам, а не только по времени.
+
+    ``get_tags(request, *args, **kwargs)`` возвращает теги страницы;
+    их версии входят в ключ кеша, поэтому ``bump_tags`` мгновенно
+    делает закешированную страницу недоступной. Ещё в ключе адрес и
+    пользователь: шапка, кнопки подписки и правки у каждого свои. Страницы
+    с формами (``vary_on_csrf``) кешируются и по CSRF-куке браузера;
+    остальные, если всё же выдали токен, не кешируются вовсе.
+
+    Кеш только серверный: браузер каждый раз переспрашивает страницу и
+    получает 304 по ETag, а не хранит её ``timeout`` секунд.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+            key = PAGE_KEY.format(make_etag(
+                f'{view_func.__module__}.{view_func.__name__}',
+                tags_digest(get_tags(request, *args, **kwargs)),
+                request.get_full_path(),
+                request.user.pk,
+                csrf_cookie if vary_on_csrf else '',
+            ))
+            response = cache.get(key)
+            if response is None:
+                # В кеш — только из основной базы (см. core.replicas).
+                replicas.use_primary()
+                response = view_func(request, *args, **kwargs)
+                if _cacheable(request, response, vary_on_csrf, csrf_cookie):
+                    cache.set(key, response, timeout)
+            patch_cache_control(
+                response, private=True, max_age=0, must_revalidate=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _cacheable(request, response, vary_on_csrf, csrf_cookie):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    if request.META.get('CSRF_COOKIE_USED'):
+        # Токен в странице годится только для той куки, что пришла с
+        # запросом; новую куку браузер получит лишь с этим ответом.
+        return vary_on_csrf and request.META.get('CSRF_COOKIE') == csrf_cookie
+    return True
@@ -0,0 +1,54 @@
+"""
+SQLite под параллельной записью.
+
+Каждое новое соединение с SQLite получает прагмы из ``SQLITE_PRAGMAS``:
+WAL, чтобы чтение не блокировало запись, ``busy_timeout``, чтобы
+занятая база означала ожидание, а не «database is locked», и кеш
+страниц с mmap. Соединения живут между запросами (``CONN_MAX_AGE``),
+поэтому прагмы выполняются один раз на соединение.
+
+``write_queue()`` пропускает записи воркера по одной и заворачивает их
+в одну транзакцию вместе с записями сигналов: потоки процесса не
+спорят за блокировку базы, а коммит — один на пост или комментарий.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_write_lock = threading.RLock()
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def write_queue(using=DEFAULT_DB_ALIAS):
+    """
+    Транзакция, в которую потоки процесса входят по очереди.
+
+    Очередь только сглаживает всплески: кто прождал дольше
+    ``SQLITE_WRITE_QUEUE_TIMEOUT`` секунд, пишет без неё и дальше ждёт
+    уже блокировку базы (``busy_timeout``). Для других СУБД и при
+    ``SQLITE_WRITE_QUEUE_TIMEOUT = None`` — просто транзакция.
+    """
+    timeout = settings.SQLITE_WRITE_QUEUE_TIMEOUT
+    queued = (
+        connections[using].vendor == 'sqlite' and timeout is not None
+        and _write_lock.acquire(timeout=timeout)
+    )
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        if queued:
+            _write_lock.release()
@@ -0,0 +1,145 @@
+"""
+Очередь фоновых задач в базе данных.
+
+``enqueue(func, *args, **kwargs)`` записывает вызов в таблицу ``Job``
+в той же транзакции, что и остальные записи запроса, и сразу
+возвращается; выполняют задачи воркеры ``manage.py run_workers``.
+Аргументы должны сериализоваться в JSON, а функция — импортироваться
+по пути ``модуль.имя``.
+
+Воркер берёт задачу, сдвигая её ``run_at`` на ``JOB_VISIBILITY_TIMEOUT``
+секунд: если он упадёт посреди работы, задачу по истечении срока заберёт
+другой. После ошибки задача повторяется через ``JOB_RETRY_DELAY``
+секунд, каждый следующий раз вдвое позже; после ``max_attempts`` попыток
+остаётся в таблице со статусом «failed» и текстом ошибки. Задачу с тем
+же ``dedup_key``, что у ещё не выполненной, повторно не ставят.
+"""
+import json
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+PENDING = (Job.QUEUED, Job.RUNNING)
+# Сколько кандидатов смотреть за раз, если задачу перехватил соседний
+# воркер.
+CLAIM_CANDIDATES = 10
+LOST_WORKER_ERROR = 'Воркер не завершил последнюю попытку'
+
+
+def task_path(func):
+    if isinstance(func, str):
+        return func
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, dedup_key=None, delay=0, max_attempts=None,
+            **kwargs):
+    """Ставит вызов ``func(*args, **kwargs)`` в очередь."""
+    Job.objects.bulk_create([Job(
+        task=task_path(func),
+        payload=json.dumps({'args': args, 'kwargs': kwargs}),
+        dedup_key=dedup_key,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )], ignore_conflicts=True)
+
+
+def retry_delay(attempts):
+    return min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1),
+               settings.JOB_RETRY_MAX_DELAY)
+
+
+def claim():
+    """
+    Забирает одну готовую задачу или возвращает None.
+
+    Задачу выбирают без блокировок, а забирают условным UPDATE по
+    прежней метке воркера: из двух воркеров, выбравших одну задачу,
+    строку обновит только первый.
+    """
+    now = timezone.now()
+    ready = Job.objects.filter(status__in=PENDING, run_at__lte=now)
+    # Задача, чей воркер погиб (OOM, SIGKILL) на последней попытке, сюда
+    # вернётся по сроку невидимости; снова её не запускаем.
+    ready.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, last_error=LOST_WORKER_ERROR)
+    candidates = ready.order_by('run_at').values_list(
+        'pk', 'claim')[:CLAIM_CANDIDATES]
+    for pk, previous in candidates:
+        token = uuid.uuid4().hex
+        taken = ready.filter(pk=pk, claim=previous).update(
+            status=Job.RUNNING,
+            claim=token,
+            attempts=F('attempts') + 1,
+            run_at=now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT),
+        )
+        if taken:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def execute(job):
+    """Выполняет взятую задачу; возвращает True, если без ошибки."""
+    # Если срок невидимости истёк и задачу забрал другой воркер, метка
+    # уже другая, и результат этого запуска ни на что не влияет.
+    owned = Job.objects.filter(pk=job.pk, claim=job.claim)
+    try:
+        payload = json.loads(job.payload)
+        import_string(job.task)(*payload['args'], **payload['kwargs'])
+    except Exception:
+        logger.exception('Задача %s (%s) упала', job.pk, job.task)
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            owned.update(status=Job.FAILED, last_error=error)
+        else:
+            owned.update(
+                status=Job.QUEUED, last_error=error,
+                run_at=timezone.now() + timedelta(
+                    seconds=retry_delay(job.attempts)),
+            )
+        return False
+    owned.delete()
+    return True
+
+
+def run_pending():
+    """Выполняет все готовые задачи в текущем потоке; возвращает их число."""
+    done = 0
+    job = claim()
+    while job is not None:
+        execute(job)
+        done += 1
+        job = claim()
+    return done
+
+
+def work(stop, poll_interval=None):
+    """Цикл воркера для потока или процесса: до ``stop.set()``."""
+    poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = claim()
+                if job is not None:
+                    execute(job)
+            except DatabaseError:
+                # Задача, которую не удалось отметить, вернётся в очередь
+                # по сроку невидимости.
+                logger.exception('Ошибка базы в воркере очереди')
+                job = None
+            if job is None:
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.sqlite_cache import SQLiteCache
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает скорость кеша SQLiteCache с LocMemCache '
+        'и FileBasedCache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations', type=int, default=2000,
+            help='Сколько раз повторить каждую операцию',
+        )
+        parser.add_argument(
+            '--value-size', type=int, default=2048,
+            help='Размер значения в байтах (страница ленты — десятки КБ)',
+        )
+
+    def handle(self, *args, **options):
+        operations = options['operations']
+        value = 'x' * options['value_size']
+        directory = tempfile.mkdtemp()
+        params = {'OPTIONS': {'MAX_ENTRIES': operations * 2}}
+        backends = {
+            'locmem': LocMemCache('benchmark', params),
+            'filebased': FileBasedCache(
+                os.path.join(directory, 'files'), params),
+            'sqlite': SQLiteCache(
+                os.path.join(directory, 'cache.sqlite3'), params),
+        }
+        try:
+            self.stdout.write(
+                f'{"операция":<10}'
+                + ''.join(f'{name:>12}' for name in backends)
+                + '   мкс на операцию'
+            )
+            for name, operation in self.operations(value, operations):
+                timings = [
+                    self.measure(cache, operation, operations)
+                    for cache in backends.values()
+                ]
+                self.stdout.write(
+                    f'{name:<10}'
+                    + ''.join(f'{timing:>12.1f}' for timing in timings)
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def operations(value, count):
+        return [
+            ('set', lambda cache, i: cache.set(f'key{i}', value)),
+            ('get', lambda cache, i: cache.get(f'key{i}')),
+            ('get_miss', lambda cache, i: cache.get(f'missing{i}')),
+            ('add', lambda cache, i: cache.add(f'key{i}', value)),
+            ('incr', lambda cache, i: cache.incr('counter')),
+            ('get_many', lambda cache, i: cache.get_many(
+                [f'key{j}' for j in range(i % count, i % count + 10)])),
+        ]
+
+    @staticmethod
+    def measure(cache, operation, count):
+        cache.set('counter', 0)
+        started = time.perf_counter()
+        for i in range(count):
+            operation(cache, i)
+        return (time.perf_counter() - started) / count * 1_000_000
@@ -0,0 +1,79 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+
+def _work_in_process(stop):
+    # Сигналы получает вся группа процессов, а останавливает воркеры
+    # родитель, дав им закончить текущие задачи.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    jobs.work(stop)
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры очереди фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.JOB_WORKERS,
+            help='Сколько задач выполнять параллельно',
+        )
+        parser.add_argument(
+            '--processes',
+            action='store_true',
+            help='Воркеры-процессы вместо потоков: для задач, '
+                 'нагружающих процессор',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить готовые задачи в этом процессе и выйти',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done = jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(
+                f'Выполнено задач: {done}'))
+            return
+        if options['processes']:
+            # Соединения с базой не должны достаться потомкам.
+            connections.close_all()
+            stop = multiprocessing.Event()
+            pool = [
+                multiprocessing.Process(
+                    target=_work_in_process, args=(stop,),
+                    name=f'worker-{number}')
+                for number in range(options['workers'])
+            ]
+        else:
+            stop = threading.Event()
+            pool = [
+                threading.Thread(
+                    target=jobs.work, args=(stop,),
+                    name=f'worker-{number}')
+                for number in range(options['workers'])
+            ]
+        for worker in pool:
+            worker.start()
+        # Обработчик только прерывает ожидание ниже: stop.set() внутри
+        # него мог бы ждать блокировку, которую держит stop.wait().
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self.stdout.write(f'Воркеров запущено: {len(pool)}')
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            stop.set()
+        self.stdout.write('Останавливаемся после текущих задач')
+        for worker in pool:
+            worker.join()
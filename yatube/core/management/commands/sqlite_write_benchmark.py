@@ -0,0 +1,154 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts import views
+from posts.models import Post, User
+
+MODES = (
+    # Как было до core.db: журнал DELETE, ожидание блокировки — только
+    # встроенные в модуль sqlite3 5 секунд, без очереди записи.
+    ('default', 'DELETE',
+     {'SQLITE_PRAGMAS': {}, 'SQLITE_WRITE_QUEUE_TIMEOUT': None}),
+    ('tuned', None, {}),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пишет посты и комментарии из нескольких потоков через '
+        'представления и сравнивает SQLite без настроек и с прагмами '
+        'из SQLITE_PRAGMAS и очередью записи'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Сколько потоков пишут одновременно',
+        )
+        parser.add_argument(
+            '--writes', type=int, default=50,
+            help='Сколько записей делает каждый поток',
+        )
+        parser.add_argument(
+            '--readers', type=int, default=2,
+            help='Сколько потоков всё это время читают ленту',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Сравнение имеет смысл только для SQLite')
+        user = User.objects.create_user(
+            f'write-benchmark-{uuid.uuid4().hex[:8]}')
+        post = Post.objects.create(author=user, text='Пост для комментариев')
+        try:
+            self.stdout.write(
+                f'{"режим":<10}{"записей/с":>12}{"429":>8}{"иных":>8}'
+                f'{"ошибок":>10}{"p95, мс":>10}{"чтений/с":>12}')
+            for name, journal_mode, overrides in MODES:
+                # Меряется база, а не RATELIMITS: один пользователь упёрся
+                # бы в предел на первых же записях.
+                with override_settings(RATELIMITS={}, **overrides):
+                    self.set_journal_mode(
+                        journal_mode
+                        or settings.SQLITE_PRAGMAS.get('journal_mode'))
+                    stats = self.run_mode(user, post, options)
+                self.stdout.write(
+                    f'{name:<10}{stats["writes"]:>12.1f}'
+                    f'{stats["limited"]:>8}{stats["other"]:>8}'
+                    f'{stats["errors"]:>10}{stats["p95"]:>10.1f}'
+                    f'{stats["reads"]:>12.1f}')
+        finally:
+            user.delete()
+
+    @staticmethod
+    def set_journal_mode(mode):
+        # Режим журнала хранится в файле базы, и сменить его можно, только
+        # пока других соединений нет: потоки прошлого прогона уже закрыты.
+        if mode:
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA journal_mode = {mode}')
+
+    def run_mode(self, user, post, options):
+        latencies, statuses, errors, reads = [], [], [], []
+        stop = threading.Event()
+        writers = [
+            threading.Thread(
+                target=self.write,
+                args=(user, post, options['writes'], latencies, statuses,
+                      errors))
+            for _ in range(options['threads'])
+        ]
+        readers = [
+            threading.Thread(target=self.read, args=(stop, reads, errors))
+            for _ in range(options['readers'])
+        ]
+        started = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for thread in readers:
+            thread.join()
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        return {
+            'writes': len(latencies) / elapsed,
+            'limited': statuses.count(429),
+            'other': len(statuses) - statuses.count(429),
+            'errors': len(errors),
+            'p95': p95 * 1000,
+            'reads': len(reads) / elapsed,
+        }
+
+    @staticmethod
+    def write(user, post, count, latencies, statuses, errors):
+        # Записью считается только редирект после сохранения; 429 и
+        # прочие ответы считаются отдельно.
+        factory = RequestFactory()
+        comment_url = reverse('posts:add_comment', args=[post.pk])
+        try:
+            for number in range(count):
+                if number % 2:
+                    request = factory.post(comment_url, {'text': 'Коммент'})
+                    view, kwargs = views.add_comment, {'post_id': post.pk}
+                else:
+                    request = factory.post(
+                        reverse('posts:post_create'), {'text': 'Пост'})
+                    view, kwargs = views.post_create, {}
+                request.user = user
+                started = time.perf_counter()
+                try:
+                    response = view(request, **kwargs)
+                except OperationalError as error:
+                    errors.append(error)
+                    continue
+                if response.status_code == 302:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    statuses.append(response.status_code)
+        finally:
+            # У каждого потока своё соединение Django.
+            connection.close()
+
+    @staticmethod
+    def read(stop, reads, errors):
+        try:
+            while not stop.is_set():
+                try:
+                    list(Post.objects.select_related('author')[:10])
+                except OperationalError as error:
+                    errors.append(error)
+                else:
+                    reads.append(1)
+        finally:
+            connection.close()
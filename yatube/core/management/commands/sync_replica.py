@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.replicas import sync_sqlite
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную SQLite-базу в локальные реплики'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Повторять каждые N секунд; без параметра — один раз',
+        )
+
+    def handle(self, *args, **options):
+        targets = []
+        for alias in settings.DATABASE_REPLICAS:
+            database = settings.DATABASES.get(alias)
+            if database is None:
+                raise CommandError(f'Нет базы {alias!r} в DATABASES')
+            if not database['ENGINE'].endswith('sqlite3'):
+                # Реплики настоящих СУБД синхронизирует сама СУБД.
+                continue
+            targets.append(database['NAME'])
+        if not targets:
+            raise CommandError('В DATABASE_REPLICAS нет реплик SQLite')
+        while True:
+            started = time.monotonic()
+            for target in targets:
+                sync_sqlite('default', target)
+            self.stdout.write(self.style.SUCCESS(
+                f'Реплики обновлены за '
+                f'{time.monotonic() - started:.2f} с: {", ".join(targets)}'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,276 @@
+"""
+Метрики производительности по представлениям в формате Prometheus.
+
+Для каждого имени URL (``posts:index``, ``posts:profile`` и т.д.)
+считаются число ответов по статусам, гистограмма времени ответа,
+число и время SQL-запросов, время отрисовки шаблонов и размер ответа.
+
+Каждый процесс копит метрики в памяти и раз в ``METRICS_FLUSH_INTERVAL``
+секунд кладёт снимок в общий кеш; ``/-/metrics`` складывает снимки всех
+живых воркеров, так что результат не зависит от того, какой воркер
+ответил на запрос Prometheus.
+"""
+import copy
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WORKERS_KEY = 'metrics:workers'
+SNAPSHOT_KEY = 'metrics:{}'
+UNRESOLVED = '<unresolved>'
+
+_current = threading.local()
+
+
+class ViewStats:
+    """Накопленные метрики одного представления."""
+    __slots__ = ('responses', 'buckets', 'duration', 'queries',
+                 'query_time', 'render_time', 'response_bytes')
+
+    def __init__(self):
+        self.responses = defaultdict(int)
+        self.buckets = [0] * len(BUCKETS)
+        self.duration = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.render_time = 0.0
+        self.response_bytes = 0
+
+    def merge(self, other):
+        for status, count in other.responses.items():
+            self.responses[status] += count
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.duration += other.duration
+        self.queries += other.queries
+        self.query_time += other.query_time
+        self.render_time += other.render_time
+        self.response_bytes += other.response_bytes
+
+    @property
+    def count(self):
+        return sum(self.responses.values())
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Registry:
+    """Метрики текущего процесса."""
+
+    def __init__(self):
+        self.views = defaultdict(ViewStats)
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    @property
+    def worker(self):
+        # pid берётся при каждом сбросе: воркеры gunicorn — форки мастера.
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def observe(self, view, status, duration, queries, query_time,
+                render_time, response_bytes):
+        with self.lock:
+            stats = self.views[view]
+            stats.responses[status] += 1
+            for index, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stats.buckets[index] += 1
+                    break
+            stats.duration += duration
+            stats.queries += queries
+            stats.query_time += query_time
+            stats.render_time += render_time
+            stats.response_bytes += response_bytes
+        if time.monotonic() - self.flushed_at >= (
+                settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Кладёт снимок метрик процесса в общий кеш."""
+        with self.lock:
+            snapshot = copy.deepcopy(dict(self.views))
+            self.flushed_at = time.monotonic()
+        timeout = settings.METRICS_FLUSH_INTERVAL * 10
+        cache.set(SNAPSHOT_KEY.format(self.worker), snapshot, timeout)
+        workers = cache.get(WORKERS_KEY, set())
+        if self.worker not in workers:
+            cache.set(WORKERS_KEY, workers | {self.worker}, None)
+
+    def collect(self):
+        """Сумма снимков всех воркеров, чьи снимки ещё не истекли."""
+        self.flush()
+        workers = cache.get(WORKERS_KEY, set())
+        snapshots = cache.get_many(
+            [SNAPSHOT_KEY.format(worker) for worker in workers])
+        alive = {key.split(':', 1)[1] for key in snapshots}
+        if alive != workers:
+            cache.set(WORKERS_KEY, alive | {self.worker}, None)
+        total = defaultdict(ViewStats)
+        for snapshot in snapshots.values():
+            for view, stats in snapshot.items():
+                total[view].merge(stats)
+        return total
+
+
+registry = Registry()
+
+
+def _label(value):
+    value = str(value).replace('\\', r'\\').replace('"', r'\"')
+    return value.replace('\n', r'\n')
+
+
+def render_prometheus(views):
+    """Текст метрик в формате Prometheus exposition 0.0.4."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples:
+            label_text = ','.join(
+                f'{key}="{_label(val)}"' for key, val in labels)
+            lines.append(f'{name}{suffix}{{{label_text}}} {value}')
+
+    ordered = sorted(views.items())
+    metric(
+        'yatube_http_responses_total', 'counter',
+        'Responses by view and status code.',
+        [('', (('view', view), ('status', status)), count)
+         for view, stats in ordered
+         for status, count in sorted(stats.responses.items())])
+    samples = []
+    for view, stats in ordered:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats.buckets):
+            cumulative += count
+            samples.append(
+                ('_bucket', (('view', view), ('le', bound)), cumulative))
+        samples.append(
+            ('_bucket', (('view', view), ('le', '+Inf')), stats.count))
+        samples.append(('_sum', (('view', view),), stats.duration))
+        samples.append(('_count', (('view', view),), stats.count))
+    metric(
+        'yatube_http_request_duration_seconds', 'histogram',
+        'Request latency by view.', samples)
+    for name, attribute, help_text in (
+        ('yatube_db_queries_total', 'queries', 'SQL queries by view.'),
+        ('yatube_db_query_seconds_total', 'query_time',
+         'Time spent in SQL queries by view.'),
+        ('yatube_template_render_seconds_total', 'render_time',
+         'Time spent rendering templates by view.'),
+        ('yatube_http_response_bytes_total', 'response_bytes',
+         'Response body size by view.'),
+    ):
+        metric(name, 'counter', help_text, [
+            ('', (('view', view),), getattr(stats, attribute))
+            for view, stats in ordered])
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time', 'render_time', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.render_time = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Снимает метрики с каждого запроса. Ставится первым в MIDDLEWARE,
+    чтобы время ответа включало все остальные middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _current.stats = stats
+        started = time.perf_counter()
+        try:
+            with _wrap_connections(stats):
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        registry.observe(
+            view=match.view_name if match else UNRESOLVED,
+            status=response.status_code,
+            duration=duration,
+            queries=stats.queries,
+            query_time=stats.query_time,
+            render_time=stats.render_time,
+            response_bytes=(0 if response.streaming
+                            else len(response.content)),
+        )
+        return response
+
+
+class _wrap_connections:
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.connections = []
+
+    def __enter__(self):
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self.wrapper)
+            self.connections.append(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for connection in self.connections:
+            connection.execute_wrappers.remove(self.wrapper)
+
+
+class InstrumentedTemplate(Template):
+    """Шаблон, добавляющий время отрисовки к метрикам запроса."""
+
+    def render(self, context=None, request=None):
+        stats = getattr(_current, 'stats', None)
+        if stats is None or stats.rendering:
+            # Вложенная отрисовка уже учтена во внешней.
+            return super().render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.render_time += time.perf_counter() - started
+            stats.rendering = False
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Стандартный движок шаблонов Django с учётом времени отрисовки."""
+
+    def from_string(self, template_code):
+        template = super().from_string(template_code)
+        return InstrumentedTemplate(template.template, self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
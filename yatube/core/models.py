@@ -0,0 +1,52 @@
+from django.db import models
+from django.db.models import Q
+
+
+class Job(models.Model):
+    """
+    Фоновая задача очереди core.jobs.
+
+    ``run_at`` — когда задачу можно взять: для новой — сразу, после
+    ошибки — через паузу повтора, у взятой — когда истечёт срок
+    невидимости и задачу сможет забрать другой воркер. Выполненные
+    задачи удаляются, упавшие все попытки остаются со статусом «failed».
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Не выполнена'),
+    )
+
+    task = models.CharField('Функция', max_length=200)
+    payload = models.TextField('Аргументы в JSON')
+    dedup_key = models.CharField(
+        'Ключ дедупликации', max_length=200, null=True, blank=True)
+    status = models.CharField(
+        'Статус', max_length=10, choices=STATUSES, default=QUEUED)
+    run_at = models.DateTimeField('Можно выполнять с')
+    attempts = models.PositiveIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveIntegerField('Наибольшее число попыток')
+    claim = models.CharField('Метка воркера', max_length=32, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        constraints = [
+            # Одинаковый ключ может быть только у одной невыполненной
+            # задачи; упавшие не мешают поставить задачу заново.
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=Q(status__in=('queued', 'running')),
+                name='unique_pending_job'),
+        ]
+        indexes = [
+            models.Index(fields=['run_at'], name='job_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
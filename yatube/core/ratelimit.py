@@ -0,0 +1,119 @@
+"""
+Ограничение частоты запросов, пишущих в базу.
+
+Каждому пользователю и каждому IP на представление полагается ведро на
+``limit`` жетонов, которое равномерно наполняется за ``period`` секунд.
+Ведро хранится одним числом в кеше (алгоритм GCRA): моментом в
+миллисекундах, когда оно снова станет полным. Запрос сдвигает этот
+момент на ``period / limit`` атомарным ``incr`` и проходит, если момент
+не дальше ``period`` от текущего времени. Проверка — один ``incr`` и
+продление срока записи на ведро, без блокировок и чтения-записи. Запись
+живёт на ``period`` дольше этого момента: раньше ведро, истёкшее из
+кеша, вернулось бы полным.
+
+Пределы задаются в ``RATELIMITS``: декоратор ``ratelimit(scope)`` берёт
+запись по своему имени, ``RateLimitMiddleware`` — запись ``'writes'``
+для всех запросов, кроме GET, HEAD и OPTIONS. Сверх предела отвечаем
+429 с заголовком ``Retry-After``.
+"""
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .views import too_many_requests
+
+KEY = 'ratelimit:{scope}:{kind}:{ident}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _identity(request, kind):
+    if kind == 'ip':
+        return request.META.get('REMOTE_ADDR')
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def _ttl(full_at, now, period):
+    """Срок записи ведра в секундах по моменту его наполнения."""
+    return max(0, math.ceil((full_at - now) / 1000)) + period
+
+
+def _take(key, step, period, now):
+    """
+    Берёт жетон из ведра; возвращает, на сколько миллисекунд запрос
+    опережает предел (0 и меньше — проходит).
+    """
+    try:
+        full_at = cache.incr(key, step)
+    except ValueError:
+        # Ведра ещё нет; add() решает гонку за его создание.
+        if cache.add(key, now + step, _ttl(now + step, now, period)):
+            return step - period * 1000
+        full_at = cache.incr(key, step)
+    if full_at < now + step:
+        # Ведро успело наполниться: отсчёт идёт от текущего момента, а
+        # не от прошлого запроса. Два таких запроса разом сдвинут его
+        # дважды — предел станет строже, но не мягче.
+        full_at = cache.incr(key, now + step - full_at)
+    cache.touch(key, _ttl(full_at, now, period))
+    return full_at - now - period * 1000
+
+
+def check(request, scope, rates):
+    """0, если запрос укладывается во все пределы ``rates``, иначе
+    сколько секунд ждать."""
+    now = int(time.time() * 1000)
+    taken, excess = [], 0
+    for kind, (limit, period) in rates.items():
+        ident = _identity(request, kind)
+        if ident is None:
+            continue
+        key = KEY.format(scope=scope, kind=kind, ident=ident)
+        step = period * 1000 // limit
+        excess = max(excess, _take(key, step, period, now))
+        taken.append((key, step, period))
+    if excess <= 0:
+        return 0
+    # Отклонённый запрос не тратит жетонов ни из одного ведра; ведро
+    # того, кто упирается в предел, не должно истечь и обнулиться.
+    for key, step, period in taken:
+        cache.touch(key, _ttl(cache.decr(key, step), now, period))
+    return max(1, math.ceil(excess / 1000))
+
+
+def ratelimit(scope, methods=('POST',)):
+    """
+    Ограничивает запросы к представлению пределами
+    ``settings.RATELIMITS[scope]``; ``methods=None`` — любые методы.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if methods is None or request.method in methods:
+                wait = check(
+                    request, scope, settings.RATELIMITS.get(scope, {}))
+                if wait:
+                    return too_many_requests(request, wait)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimitMiddleware:
+    """Общий предел на запись с одного IP, до сессий и авторизации."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            wait = check(
+                request, 'writes', settings.RATELIMITS.get('writes', {}))
+            if wait:
+                return too_many_requests(request, wait)
+        return self.get_response(request)
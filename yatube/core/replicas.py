@@ -0,0 +1,113 @@
+"""
+Чтение страниц из реплик базы.
+
+``ReplicaMiddleware`` по имени URL решает, можно ли читать запрос из
+реплики: только GET и HEAD и только представления из
+``DATABASE_REPLICA_VIEWS``. Выбранный алиас хранится в thread-local, и
+``ReplicaRouter`` отдаёт его для чтения; запись всегда идёт в
+``default``.
+
+Реплика отстаёт от основной базы, поэтому запрос, который что-то
+записал, ставит куку ``DATABASE_PIN_COOKIE``: следующие
+``DATABASE_PIN_SECONDS`` секунд этот браузер читает из основной базы и
+сразу видит свой пост, комментарий или подписку. Запись посреди запроса
+тоже переключает его оставшиеся чтения на основную базу.
+
+Страницы, которые попадут в кеш (``cache_page_tagged``), при промахе
+читаются из основной базы: иначе отставшая реплика закрепила бы в кеше
+старые данные под уже новой версией тегов до конца таймаута.
+
+Локальная реплика — копия SQLite, которую обновляет команда
+``sync_replica``.
+"""
+import random
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_state = threading.local()
+
+
+def replicas():
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if alias in settings.DATABASES
+    ]
+
+
+def use_primary():
+    """Оставшиеся чтения текущего запроса идут в основную базу."""
+    _state.alias = None
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        # None — решение за следующими роутерами, то есть default.
+        return getattr(_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        _state.alias = None
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # В репликах те же строки, что в основной базе.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaMiddleware:
+    """Ставится до SessionMiddleware, чтобы сохранение сессии тоже
+    считалось записью."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.alias = None
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.alias = None
+            _state.wrote = False
+        if wrote and replicas():
+            response.set_cookie(
+                settings.DATABASE_PIN_COOKIE, '1',
+                max_age=settings.DATABASE_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in SAFE_METHODS
+                and request.resolver_match.view_name in (
+                    settings.DATABASE_REPLICA_VIEWS)
+                and settings.DATABASE_PIN_COOKIE not in request.COOKIES):
+            aliases = replicas()
+            if aliases:
+                _state.alias = random.choice(aliases)
+
+
+def sync_sqlite(source_alias, target_path):
+    """
+    Копирует SQLite-базу ``source_alias`` в файл ``target_path``.
+
+    Копия пишется на место, через backup API SQLite: открытые
+    соединения с репликой видят либо старую, либо новую версию целиком.
+    """
+    source = connections[source_alias]
+    source.ensure_connection()
+    target = sqlite3.connect(target_path)
+    try:
+        source.connection.backup(target)
+    finally:
+        target.close()
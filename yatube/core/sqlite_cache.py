@@ -0,0 +1,316 @@
+"""
+Кеш в файле SQLite, общий для всех процессов на одной машине.
+
+В отличие от ``LocMemCache``, записи видят все воркеры gunicorn, так что
+``cache_page`` и сброс кеша по тегам работают согласованно; в отличие от
+``FileBasedCache``, объём ограничен с вытеснением давно не читанных
+записей (LRU), а ``add`` и ``incr`` атомарны между процессами.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Ограничение SQLite на число параметров в одном запросе.
+MAX_QUERY_PARAMS = 900
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    '  key TEXT PRIMARY KEY,'
+    '  value BLOB NOT NULL,'
+    '  expires REAL,'
+    '  accessed REAL NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires_idx ON cache (expires)',
+    # Число записей и байт ведут триггеры, чтобы не считать COUNT(*)
+    # при каждой записи.
+    'CREATE TABLE IF NOT EXISTS cache_stats ('
+    '  id INTEGER PRIMARY KEY CHECK (id = 0),'
+    '  entries INTEGER NOT NULL,'
+    '  bytes INTEGER NOT NULL'
+    ')',
+    'INSERT OR IGNORE INTO cache_stats VALUES (0, 0, 0)',
+    'CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN'
+    '  UPDATE cache_stats SET entries = entries + 1,'
+    '    bytes = bytes + length(NEW.value);'
+    ' END',
+    'CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN'
+    '  UPDATE cache_stats SET entries = entries - 1,'
+    '    bytes = bytes - length(OLD.value);'
+    ' END',
+    'CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF value'
+    ' ON cache BEGIN'
+    '  UPDATE cache_stats'
+    '    SET bytes = bytes + length(NEW.value) - length(OLD.value);'
+    ' END',
+)
+
+UPSERT = (
+    'INSERT INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+    'expires = excluded.expires, accessed = excluded.accessed'
+)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Бэкенд кеша поверх файла SQLite в режиме WAL.
+
+    ``LOCATION`` — путь к файлу базы. Дополнительно к ``MAX_ENTRIES`` и
+    ``CULL_FREQUENCY`` понимает ``OPTIONS``: ``MAX_SIZE`` — предел суммарного
+    размера значений в байтах, ``MMAP_SIZE`` — сколько байт файла читать
+    через mmap, ``TIMEOUT`` — сколько секунд ждать блокировку записи,
+    ``ACCESS_RESOLUTION`` — с какой точностью в секундах запоминать
+    последнее чтение для LRU (чтобы не писать в файл на каждый ``get``).
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = os.path.abspath(location)
+        self._max_size = options.get('MAX_SIZE')
+        self._mmap_size = int(options.get('MMAP_SIZE', 64 * 1024 * 1024))
+        self._busy_timeout = float(options.get('TIMEOUT', 5))
+        self._access_resolution = float(options.get('ACCESS_RESOLUTION', 1))
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        # Соединение своё у каждого потока и каждого процесса после fork.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._connect()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        connection = sqlite3.connect(
+            self._path, timeout=self._busy_timeout, isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute(f'PRAGMA mmap_size = {self._mmap_size}')
+        with _immediate(connection):
+            for statement in SCHEMA:
+                connection.execute(statement)
+        return connection
+
+    def _dumps(self, value):
+        # Целые числа храним как INTEGER: их можно прибавлять в SQL.
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, self.pickle_protocol)
+
+    @staticmethod
+    def _loads(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        connection = self._connection
+        with _immediate(connection):
+            cursor = connection.execute(
+                'INSERT INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+                'expires = excluded.expires, accessed = excluded.accessed '
+                'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+                (key, self._dumps(value), self.get_backend_timeout(timeout),
+                 now, now),
+            )
+            added = cursor.rowcount > 0
+            if added:
+                self._cull(connection, now)
+        return added
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_key(key, version=version): key for key in keys}
+        for key in key_map:
+            self.validate_key(key)
+        found = self._get_many(list(key_map))
+        return {key_map[key]: value for key, value in found.items()}
+
+    def _get_many(self, keys):
+        now = time.time()
+        connection = self._connection
+        found, touched = {}, []
+        for start in range(0, len(keys), MAX_QUERY_PARAMS):
+            chunk = keys[start:start + MAX_QUERY_PARAMS]
+            rows = connection.execute(
+                'SELECT key, value, expires, accessed FROM cache '
+                f'WHERE key IN ({", ".join("?" * len(chunk))})',
+                chunk,
+            )
+            for key, value, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[key] = self._loads(value)
+                if accessed < now - self._access_resolution:
+                    touched.append(key)
+        if touched:
+            self._touch_access(connection, touched, now)
+        return found
+
+    def _touch_access(self, connection, keys, now):
+        try:
+            with _immediate(connection):
+                connection.executemany(
+                    'UPDATE cache SET accessed = ? WHERE key = ?',
+                    [(now, key) for key in keys],
+                )
+        except sqlite3.OperationalError:
+            # Не дождались блокировки: чтение важнее точности LRU.
+            pass
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append((key, self._dumps(value), expires, now))
+        connection = self._connection
+        with _immediate(connection):
+            connection.executemany(UPSERT, rows)
+            self._cull(connection, now)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        connection = self._connection
+        with _immediate(connection):
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ?, accessed = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), now, key, now),
+            )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        connection = self._connection
+        with _immediate(connection):
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = self._loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ?, accessed = ? WHERE key = ?',
+                (self._dumps(value), now, key),
+            )
+        return value
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version) > 0
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        deleted = 0
+        connection = self._connection
+        with _immediate(connection):
+            for start in range(0, len(keys), MAX_QUERY_PARAMS):
+                chunk = keys[start:start + MAX_QUERY_PARAMS]
+                deleted += connection.execute(
+                    'DELETE FROM cache '
+                    f'WHERE key IN ({", ".join("?" * len(chunk))})',
+                    chunk,
+                ).rowcount
+        return deleted
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def clear(self):
+        connection = self._connection
+        with _immediate(connection):
+            connection.execute('DELETE FROM cache')
+
+    def stats(self):
+        """Число записей и суммарный размер значений в байтах."""
+        entries, size = self._connection.execute(
+            'SELECT entries, bytes FROM cache_stats').fetchone()
+        return {'entries': entries, 'bytes': size}
+
+    def _over_limit(self, connection):
+        entries, size = connection.execute(
+            'SELECT entries, bytes FROM cache_stats').fetchone()
+        return (entries > self._max_entries
+                or self._max_size is not None and size > self._max_size)
+
+    def _cull(self, connection, now):
+        """
+        Освобождает место: сначала удаляет просроченные записи, затем —
+        дольше всех не читанные, по ``1 / CULL_FREQUENCY`` от их числа.
+        """
+        if not self._over_limit(connection):
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?',
+            (now,),
+        )
+        if self._cull_frequency == 0:
+            if self._over_limit(connection):
+                connection.execute('DELETE FROM cache')
+            return
+        while self._over_limit(connection):
+            entries = connection.execute(
+                'SELECT entries FROM cache_stats').fetchone()[0]
+            connection.execute(
+                'DELETE FROM cache WHERE key IN ('
+                '  SELECT key FROM cache ORDER BY accessed LIMIT ?'
+                ')',
+                (max(entries // self._cull_frequency, 1),),
+            )
+
+
+class _immediate:
+    """Транзакция, сразу берущая блокировку записи (BEGIN IMMEDIATE)."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')
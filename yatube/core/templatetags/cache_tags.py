@@ -0,0 +1,15 @@
+from django import template
+
+from core.caching import tags_digest
+
+register = template.Library()
+
+
+@register.simple_tag
+def cache_tags_version(*tags):
+    """
+    Версия набора тегов для ``{% cache %}``:
+    {% cache_tags_version 'feed:index' as version %}
+    {% cache 300 sidebar version %}...{% endcache %}
+    """
+    return tags_digest(tags)
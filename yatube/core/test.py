@@ -1,4 +1,30 @@
-from django.test import TestCase
+import multiprocessing
+import shutil
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase)
+from django.test.utils import override_settings
+from django.urls import resolve, reverse
+
+from core import jobs
+from core.caching import bump_tags, cache_page_tagged, tags_digest
+from core.db import write_queue
+from core.metrics import registry
+from core.models import Job
+from core.ratelimit import check
+from core.replicas import ReplicaMiddleware, ReplicaRouter, sync_sqlite
+from core.sqlite_cache import SQLiteCache
+from posts.models import Group, Post
 
 
 class CastomPageURLTests(TestCase):
@@ -10,3 +36,449 @@ class CastomPageURLTests(TestCase):
         """The URL uses the appropriate pattern."""
         response = self.client.get('unexisting')
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class CacheTagsTests(TestCase):
+
+    def test_bump_tags_changes_only_related_digests(self):
+        """Bumping a tag changes the digest of every tag set containing it."""
+        index = tags_digest(['feed:index'])
+        post = tags_digest(['post:1', 'author:auth'])
+        self.assertEqual(index, tags_digest(['feed:index']))
+        bump_tags('author:auth')
+        self.assertEqual(index, tags_digest(['feed:index']))
+        self.assertNotEqual(post, tags_digest(['post:1', 'author:auth']))
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.views.clear()
+
+    def sample(self, text, name, view):
+        prefix = f'{name}{{view="{view}"}} '
+        for line in text.splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        self.fail(f'{prefix} not found')
+
+    def test_metrics_are_recorded_per_view(self):
+        """Latency, SQL, rendering and size are exposed per URL name."""
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn(
+            'yatube_http_responses_total{view="posts:index",status="200"} 1',
+            text)
+        self.assertIn(
+            'yatube_http_request_duration_seconds_count'
+            '{view="posts:index"} 1', text)
+        self.assertGreater(
+            self.sample(text, 'yatube_db_queries_total', 'posts:index'), 0)
+        self.assertGreater(self.sample(
+            text, 'yatube_template_render_seconds_total', 'posts:index'), 0)
+        self.assertGreater(self.sample(
+            text, 'yatube_http_response_bytes_total', 'posts:index'), 0)
+
+    def test_metrics_are_internal(self):
+        """The endpoint is hidden from addresses outside the allow list."""
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN='scrape-secret', METRICS_ALLOWED_IPS=[])
+    def test_metrics_token(self):
+        """Outside the allow list only the configured bearer token passes."""
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(
+            url, HTTP_AUTHORIZATION='Bearer wrong-secret')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            url, HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(INTERNAL_IPS=['203.0.113.5'])
+    def test_metrics_allow_list_is_separate(self):
+        """Debug toolbar addresses do not open the metrics endpoint."""
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def route(self, request, write=False):
+        """Runs the middleware and records where the view would read."""
+        seen = {}
+
+        def view(request):
+            middleware.process_view(request, None, (), {})
+            seen['read'] = self.router.db_for_read(Post)
+            if write:
+                self.router.db_for_write(Post)
+                seen['after_write'] = self.router.db_for_read(Post)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        request.resolver_match = resolve(request.path)
+        seen['response'] = middleware(request)
+        return seen
+
+    def test_read_only_views_read_from_replica(self):
+        """Only safe requests to the listed views go to the replica."""
+        factory = RequestFactory()
+        self.assertEqual(
+            self.route(factory.get(reverse('posts:index')))['read'],
+            'replica')
+        self.assertEqual(
+            self.route(factory.get(reverse('about:tech')))['read'],
+            'replica')
+        self.assertIsNone(
+            self.route(factory.get(reverse('posts:post_create')))['read'])
+        self.assertIsNone(
+            self.route(factory.post(reverse('posts:index')))['read'])
+
+    def test_writes_pin_the_browser_to_primary(self):
+        """After a write the request and the next ones read from default."""
+        factory = RequestFactory()
+        seen = self.route(
+            factory.get(reverse('posts:index')), write=True)
+        self.assertIsNone(seen['after_write'])
+        cookie = seen['response'].cookies['db_pin']
+        self.assertEqual(cookie['max-age'], 15)
+        request = factory.get(reverse('posts:index'))
+        request.COOKIES['db_pin'] = cookie.value
+        self.assertIsNone(self.route(request)['read'])
+        self.assertNotIn(
+            'db_pin',
+            self.route(factory.get(reverse('posts:index')))[
+                'response'].cookies)
+
+    def test_page_cache_misses_read_from_primary(self):
+        """A page about to be cached is not rendered from a lagging replica."""
+        seen = {}
+
+        @cache_page_tagged(60, lambda request: ['replica-test'])
+        def cached(request):
+            seen['read'] = self.router.db_for_read(Post)
+            return HttpResponse()
+
+        def view(request):
+            middleware.process_view(request, None, (), {})
+            seen['before'] = self.router.db_for_read(Post)
+            return cached(request)
+
+        middleware = ReplicaMiddleware(view)
+        request = RequestFactory().get(reverse('posts:index'))
+        request.resolver_match = resolve(request.path)
+        request.user = AnonymousUser()
+        middleware(request)
+        self.assertEqual(seen['before'], 'replica')
+        self.assertIsNone(seen['read'])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_reads_default(self):
+        """With no replicas configured nothing is routed or pinned."""
+        seen = self.route(
+            RequestFactory().get(reverse('posts:index')), write=True)
+        self.assertIsNone(seen['read'])
+        self.assertNotIn('db_pin', seen['response'].cookies)
+
+
+class ReplicaSyncTests(TransactionTestCase):
+    # Копия снимается с закоммиченных данных, поэтому без обёртки TestCase.
+
+    def test_sync_copies_the_database(self):
+        """sync_sqlite writes a readable copy of the primary database."""
+        Group.objects.create(title='Группа', slug='replica-group')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        target = f'{directory}/replica.sqlite3'
+        sync_sqlite('default', target)
+        Group.objects.create(title='Вторая', slug='second-group')
+        sync_sqlite('default', target)
+        copy = sqlite3.connect(target)
+        self.addCleanup(copy.close)
+        slugs = {slug for slug, in copy.execute(
+            'SELECT slug FROM posts_group')}
+        self.assertEqual(slugs, {'replica-group', 'second-group'})
+
+
+class SQLiteTuningTests(TestCase):
+
+    def test_pragmas_are_applied_to_connections(self):
+        """Every SQLite connection gets the pragmas from settings."""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 10000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_write_queue_is_one_transaction(self):
+        """Writes inside the queue are rolled back together."""
+        with self.assertRaises(RuntimeError):
+            with write_queue():
+                Group.objects.create(title='Группа', slug='queued')
+                raise RuntimeError
+        self.assertFalse(Group.objects.filter(slug='queued').exists())
+
+
+CALLS = []
+
+
+def record_call(*args, **kwargs):
+    CALLS.append((args, kwargs))
+
+
+def fail():
+    raise RuntimeError('boom')
+
+
+@override_settings(JOB_RETRY_DELAY=10, JOB_MAX_ATTEMPTS=3)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueued_job_runs_later(self):
+        """enqueue only stores the call; a worker runs and removes it."""
+        jobs.enqueue(record_call, 1, 'two', flag=True)
+        self.assertEqual(CALLS, [])
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(CALLS, [((1, 'two'), {'flag': True})])
+        self.assertFalse(Job.objects.exists())
+
+    def test_dedup_key_keeps_one_pending_job(self):
+        """A second job with the same key is dropped until the first ran."""
+        jobs.enqueue(record_call, 1, dedup_key='same')
+        jobs.enqueue(record_call, 2, dedup_key='same')
+        self.assertEqual(Job.objects.count(), 1)
+        jobs.run_pending()
+        jobs.enqueue(record_call, 3, dedup_key='same')
+        jobs.run_pending()
+        self.assertEqual(CALLS, [((1,), {}), ((3,), {})])
+
+    def test_failed_job_is_retried_with_backoff(self):
+        """Errors reschedule the job with doubling delays, then fail it."""
+        jobs.enqueue(fail)
+        delays = []
+        for _ in range(3):
+            job = jobs.claim()
+            self.assertFalse(jobs.execute(job))
+            job.refresh_from_db()
+            delays.append(round((job.run_at - job.created).total_seconds()))
+            Job.objects.update(run_at=job.created)
+        self.assertEqual(delays[:2], [10, 20])
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('boom', job.last_error)
+        self.assertIsNone(jobs.claim())
+
+    def test_claimed_job_is_invisible_until_timeout(self):
+        """A running job goes back to the queue only after its timeout."""
+        jobs.enqueue(record_call)
+        first = jobs.claim()
+        self.assertIsNone(jobs.claim())
+        Job.objects.update(run_at=first.created)
+        second = jobs.claim()
+        self.assertNotEqual(first.claim, second.claim)
+        self.assertEqual(second.attempts, 2)
+        # Опоздавший первый воркер не трогает чужую задачу.
+        jobs.execute(first)
+        self.assertTrue(Job.objects.filter(pk=second.pk).exists())
+
+    def test_job_that_kills_its_worker_is_not_claimed_forever(self):
+        """A job lost on its last attempt fails instead of running again."""
+        jobs.enqueue(record_call, max_attempts=2)
+        for _ in range(2):
+            job = jobs.claim()
+            self.assertIsNotNone(job)
+            # Воркер погиб, не дойдя до execute().
+            Job.objects.update(run_at=job.created)
+        self.assertIsNone(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.last_error, jobs.LOST_WORKER_ERROR)
+        self.assertEqual(CALLS, [])
+
+    def test_password_reset_email_is_sent_by_worker(self):
+        """The reset view only enqueues the email."""
+        get_user_model().objects.create_user(
+            'reader', email='reader@example.com', password='secret-pass')
+        response = self.client.post(
+            reverse('users:password_reset'), {'email': 'reader@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        jobs.run_pending()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+
+
+@override_settings(RATELIMITS={
+    'writes': {'ip': (100, 60)},
+    'posts:add_comment': {'user': (2, 60), 'ip': (3, 60)},
+    'users:signup': {'ip': (1, 3600)},
+})
+class RateLimitTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('writer')
+        cls.other = get_user_model().objects.create_user('other')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:add_comment', args=[self.post.pk])
+
+    def comment(self, user):
+        self.client.force_login(user)
+        return self.client.post(self.url, {'text': 'Коммент'})
+
+    def test_user_over_limit_gets_429(self):
+        """The third comment in a minute is refused with Retry-After."""
+        self.assertEqual(self.comment(self.user).status_code, 302)
+        self.assertEqual(self.comment(self.user).status_code, 302)
+        response = self.comment(self.user)
+        self.assertEqual(response.status_code, 429)
+        self.assertTemplateUsed(response, 'core/429.html')
+        self.assertTrue(1 <= int(response['Retry-After']) <= 30)
+        self.assertEqual(self.post.comments.count(), 2)
+
+    def test_ip_limit_covers_all_users(self):
+        """Other users share the bucket of their address."""
+        self.comment(self.user)
+        self.comment(self.user)
+        self.assertEqual(self.comment(self.other).status_code, 302)
+        self.assertEqual(self.comment(self.other).status_code, 429)
+
+    def test_refused_requests_do_not_spend_tokens(self):
+        """Hammering while refused does not extend the wait."""
+        request = RequestFactory().post('/')
+        rates = {'ip': (2, 60)}
+        self.assertEqual(check(request, 'test', rates), 0)
+        self.assertEqual(check(request, 'test', rates), 0)
+        full_at = cache.get('ratelimit:test:ip:127.0.0.1')
+        waits = {check(request, 'test', rates) for _ in range(5)}
+        self.assertLessEqual(max(waits), 30)
+        self.assertEqual(cache.get('ratelimit:test:ip:127.0.0.1'), full_at)
+
+    def test_busy_bucket_does_not_expire_early(self):
+        """The entry lives as long as its stored full-at moment needs."""
+        request = RequestFactory().post('/')
+        rates = {'ip': (2, 60)}
+        start = time.time()
+        for offset, allowed in ((0, True), (0, True), (100, True),
+                                (100, True), (121, False)):
+            with mock.patch('time.time', return_value=start + offset):
+                self.assertEqual(check(request, 'test', rates) == 0, allowed)
+
+    def test_signup_is_limited_per_ip(self):
+        """Only form submissions count, not opening the form."""
+        url = reverse('users:signup')
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.post(url, {})
+        self.assertEqual(self.client.post(url, {}).status_code, 429)
+
+    @override_settings(RATELIMITS={'writes': {'ip': (1, 60)}})
+    def test_middleware_limits_every_write(self):
+        """The global bucket applies to any non-GET request."""
+        self.client.post(reverse('users:login'), {})
+        self.assertEqual(
+            self.client.post(reverse('users:login'), {}).status_code, 429)
+        self.assertEqual(
+            self.client.get(reverse('users:login')).status_code, 200)
+
+
+def _incr_many(location, times):
+    cache = SQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('hits')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = f'{self.directory}/cache.sqlite3'
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_entries_are_shared_between_instances(self):
+        """Another process opening the same file sees the same entries."""
+        self.cache.set('key', {'value': [1, 2]})
+        other = self.make_cache()
+        self.assertEqual(other.get('key'), {'value': [1, 2]})
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expired_entries_are_not_returned(self):
+        """An expired entry is a miss and can be added again."""
+        self.cache.set('key', 'old', timeout=0)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 'new'))
+        self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_add_keeps_existing_value(self):
+        """add() stores a value only when the key is missing."""
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_incr(self):
+        """incr() changes numbers and fails on missing keys."""
+        self.cache.set('number', 10)
+        self.assertEqual(self.cache.incr('number', 5), 15)
+        self.assertEqual(self.cache.decr('number'), 14)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_incr_is_atomic_between_processes(self):
+        """Concurrent increments from several processes are not lost."""
+        self.cache.set('hits', 0)
+        workers = [
+            multiprocessing.Process(
+                target=_incr_many, args=(self.location, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('hits'), 200)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Over MAX_ENTRIES the entries read longest ago are dropped."""
+        cache = self.make_cache(
+            MAX_ENTRIES=4, CULL_FREQUENCY=4, ACCESS_RESOLUTION=0)
+        for number in range(4):
+            cache.set(f'key{number}', number)
+            time.sleep(0.01)
+        cache.get('key0')
+        cache.set('key4', 4)
+        self.assertEqual(cache.stats()['entries'], 4)
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(cache.get('key0'), 0)
+
+    def test_total_size_is_bounded(self):
+        """Values over MAX_SIZE in total push out older entries."""
+        cache = self.make_cache(MAX_SIZE=1000)
+        for number in range(10):
+            cache.set(f'key{number}', b'x' * 300)
+        self.assertLessEqual(cache.stats()['bytes'], 1000)
+        self.assertIsNotNone(cache.get('key9'))
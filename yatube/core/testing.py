@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+@contextmanager
+def temporary_caches():
+    """
+    Кеши во временном каталоге на время блока: ``cache.clear()`` в
+    тестах не трогает общий кеш разработчика и сервера. Им пользуются и
+    ``manage.py test``, и pytest (tests/fixtures/fixture_cache.py).
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-test-cache-')
+    caches = {
+        alias: dict(options, LOCATION=os.path.join(
+            directory, f'{alias}.sqlite3'))
+        for alias, options in settings.CACHES.items()
+    }
+    try:
+        with override_settings(CACHES=caches):
+            yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """Прогон тестов с кешами во временном каталоге."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.caches = temporary_caches()
+        self.caches.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -1,7 +1,12 @@
+import hmac
 from http import HTTPStatus
 
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from .metrics import registry, render_prometheus
+
 
 def page_not_found(request, exception):
     return render(
@@ -16,5 +21,40 @@ def csrf_failure(request, reason=""):
     return render('core/403csrf.html', ctx)
 
 
+def too_many_requests(request, retry_after):
+    response = render(
+        request, 'core/429.html',
+        {'retry_after': retry_after},
+        status=HTTPStatus.TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
 def handler500(request):
     return render(request, 'core/500.html')
+
+
+def _metrics_allowed(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, given = request.META.get(
+            'HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(
+                given.encode(), token.encode()):
+            return True
+    # REMOTE_ADDR — адрес того, кто подключился: за прокси это прокси.
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    """
+    Метрики представлений для Prometheus: по METRICS_TOKEN или с адресов
+    METRICS_ALLOWED_IPS (см. settings), остальным — 404.
+    """
+    if not _metrics_allowed(request):
+        raise Http404
+    return HttpResponse(
+        render_prometheus(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Comment, Follow, Group, Post
+from . import search
+from .models import (AuthorStats, Comment, Follow, Group, ImportCheckpoint,
+                     Post, TimelineEntry)
 
 
 @admin.register(Post)
@@ -11,6 +13,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по полнотекстовому индексу вместо LIKE '%...%'."""
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
+
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
@@ -27,3 +35,21 @@ class CommentAdmin(admin.ModelAdmin):
 class FollowAdmin(admin.ModelAdmin):
     list_display = ('pk', 'user', 'author')
     list_editable = ('user', 'author')
+
+
+@admin.register(TimelineEntry)
+class TimelineEntryAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'post', 'pub_date')
+    list_filter = ('pub_date',)
+
+
+@admin.register(AuthorStats)
+class AuthorStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'user', 'posts_count', 'followers_count', 'following_count')
+    readonly_fields = ('posts_count', 'followers_count', 'following_count')
+
+
+@admin.register(ImportCheckpoint)
+class ImportCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'source', 'position', 'updated')
@@ -0,0 +1,176 @@
+"""
+JSON-версии лент и страницы поста только для чтения.
+
+Ленты листаются курсором ``?cursor=`` (как HTML-ленты), ``?fields=``
+выбирает поля постов, и из базы читаются только нужные столбцы.
+Ответы отдают ``ETag``, а на ``If-None-Match`` без изменений отвечают
+``304`` до выборки и сериализации постов: состояние ленты — дата самого
+свежего поста, число постов (из кеша счётчиков лент) и версии тегов
+кеша, которые меняются и при правке постов. ``Last-Modified`` нет:
+правки и комментарии не двигают дату публикации.
+"""
+from django.conf import settings
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import require_safe
+
+from core.caching import conditional
+
+from .models import Group, Post, User
+from .utils import (CursorPaginator, author_state, group_state, index_state,
+                    post_state)
+
+# Поле ответа → столбцы, которые нужны для него в .only().
+POST_FIELDS = {
+    'id': ('pk',),
+    'text': ('text',),
+    'pub_date': ('pub_date',),
+    'author': ('author', 'author__username'),
+    'group': ('group', 'group__slug'),
+    'image': ('image',),
+    'url': ('pk',),
+}
+DETAIL_FIELDS = {**POST_FIELDS, 'comments_count': ('comments_count',)}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def json_response(data, status=200):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def selected_fields(request, available):
+    """Поля из ``?fields=a,b``; без параметра — все доступные."""
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(available)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise BadRequest(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def only_fields(queryset, fields, available):
+    """Ограничивает выборку столбцами выбранных полей и курсора."""
+    columns = {'pk', 'pub_date'}
+    related = []
+    for name in fields:
+        columns.update(available[name])
+        if name in ('author', 'group'):
+            related.append(name)
+    return queryset.select_related(*related).only(*columns)
+
+
+def serialize_post(request, post, fields):
+    values = {
+        'id': lambda: post.pk,
+        'text': lambda: post.text,
+        'pub_date': lambda: post.pub_date.isoformat(),
+        'author': lambda: post.author.username,
+        'group': lambda: post.group.slug if post.group_id else None,
+        'image': lambda: (
+            request.build_absolute_uri(post.image.url)
+            if post.image else None),
+        'url': lambda: request.build_absolute_uri(
+            reverse('posts:api_post', kwargs={'post_id': post.pk})),
+        'comments_count': lambda: post.comments_count,
+    }
+    return {name: values[name]() for name in fields}
+
+
+def _page_url(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+
+def feed_response(request, queryset, extra=None):
+    try:
+        fields = selected_fields(request, POST_FIELDS)
+    except BadRequest as error:
+        return json_response({'error': str(error)}, status=400)
+    paginator = CursorPaginator(
+        only_fields(queryset, fields, POST_FIELDS),
+        settings.AMOUNT_OF_POSTS_TO_DISPLAY)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return json_response({
+        **(extra or {}),
+        'results': [serialize_post(request, post, fields) for post in page],
+        'next': _page_url(request, paginator.next_cursor),
+        'previous': _page_url(request, paginator.previous_cursor),
+    })
+
+
+@require_safe
+@conditional(lambda request: index_state(counted=True))
+def index(request):
+    return feed_response(request, Post.objects.all())
+
+
+@require_safe
+@conditional(lambda request, slug: group_state(slug, counted=True))
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return feed_response(request, group.posts.all(), extra={
+        'group': {
+            'slug': group.slug,
+            'title': group.title,
+            'description': group.description,
+        },
+    })
+
+
+@require_safe
+@conditional(
+    lambda request, username: author_state(username, counted=True))
+def profile(request, username):
+    user_obj = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    return feed_response(request, user_obj.posts.all(), extra={
+        'author': {
+            'username': user_obj.username,
+            'full_name': user_obj.get_full_name(),
+            'posts_count': user_obj.stats.posts_count,
+            'followers_count': user_obj.stats.followers_count,
+            'following_count': user_obj.stats.following_count,
+        },
+    })
+
+
+@require_safe
+@conditional(lambda request, post_id: post_state(post_id))
+def post_detail(request, post_id):
+    try:
+        fields = selected_fields(request, DETAIL_FIELDS)
+    except BadRequest as error:
+        return json_response({'error': str(error)}, status=400)
+    post = get_object_or_404(
+        only_fields(Post.objects.all(), fields, DETAIL_FIELDS), pk=post_id)
+    paginator = CursorPaginator(
+        post.comments.select_related('author').only(
+            'pk', 'text', 'created', 'author', 'author__username'),
+        settings.COMMENTS_PER_PAGE,
+        ordering=('created', 'pk'),
+    )
+    comments = paginator.get_page(request.GET.get('cursor'))
+    return json_response({
+        **serialize_post(request, post, fields),
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            }
+            for comment in comments
+        ],
+        'comments_next': _page_url(request, paginator.next_cursor),
+        'comments_previous': _page_url(request, paginator.previous_cursor),
+    })
@@ -0,0 +1,166 @@
+from django.db import transaction
+from django.db.models import (Count, DateTimeField, F, OuterRef, Subquery,
+                              Value)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .utils import chunked
+
+
+def _counted(queryset, field):
+    """Подзапрос COUNT(*) строк ``queryset``, связанных через ``field``."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def real_user_counts():
+    return User.objects.annotate(
+        real_posts=_counted(Post.objects, 'author'),
+        real_followers=_counted(Follow.objects, 'author'),
+        real_following=_counted(Follow.objects, 'user'),
+    )
+
+
+def recount_user(user_id):
+    """Пересчитывает счётчики пользователя по таблицам постов и подписок."""
+    user = real_user_counts().get(pk=user_id)
+    AuthorStats.objects.update_or_create(user_id=user_id, defaults={
+        'posts_count': user.real_posts,
+        'followers_count': user.real_followers,
+        'following_count': user.real_following,
+    })
+
+
+def change_user_counters(user_id, **deltas):
+    """
+    Атомарно сдвигает счётчики пользователя: posts_count=1 и т.п.
+
+    Если строки со счётчиками ещё нет, при увеличении она создаётся
+    пересчётом; при уменьшении (в том числе при удалении самого
+    пользователя) отсутствие строки не ошибка.
+    """
+    updated = AuthorStats.objects.filter(user_id=user_id).update(**{
+        name: Greatest(F(name) + delta, 0) for name, delta in deltas.items()
+    })
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        recount_user(user_id)
+
+
+def add_counts(queryset, field, counts, key='pk'):
+    """
+    Сдвигает ``field`` у многих строк ``queryset`` сразу: ``counts`` —
+    {значение ``key``: прирост}. Строки с одинаковым приростом
+    обновляются одним UPDATE.
+    """
+    by_delta = {}
+    for value, delta in counts.items():
+        by_delta.setdefault(delta, []).append(value)
+    for delta, values in by_delta.items():
+        for chunk in chunked(values):
+            queryset.filter(**{f'{key}__in': chunk}).update(
+                **{field: F(field) + delta})
+
+
+def add_user_counts(field, counts):
+    """
+    ``change_user_counters`` для многих пользователей: ``counts`` —
+    {user_id: прирост счётчика ``field``}. Недостающие строки
+    счётчиков создаются пересчётом.
+    """
+    add_counts(AuthorStats.objects, field, counts, key='user_id')
+    missing = set(counts)
+    for chunk in chunked(counts):
+        missing.difference_update(AuthorStats.objects.filter(
+            user_id__in=chunk).values_list('user_id', flat=True))
+    for user_id in missing:
+        recount_user(user_id)
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0))
+
+
+def _latest_post_date():
+    """Подзапрос даты последнего поста группы по индексу (group, pub_date)."""
+    return Subquery(
+        Post.objects.filter(group=OuterRef('pk')).order_by(
+            '-pub_date').values('pub_date')[:1])
+
+
+def real_group_counts():
+    return Group.objects.annotate(
+        real_posts=_counted(Post.objects, 'group'),
+        real_last_post_at=_latest_post_date(),
+    )
+
+
+def change_group_counters(group_id, delta, pub_date=None):
+    """
+    Сдвигает число постов группы на ``delta``.
+
+    Новый пост с датой ``pub_date`` может только сдвинуть дату последнего
+    поста вперёд; после удаления или переноса поста в другую группу она
+    берётся заново из таблицы постов.
+    """
+    if pub_date is not None:
+        pub_date = Value(pub_date, output_field=DateTimeField())
+        last_post_at = Greatest(Coalesce('last_post_at', pub_date), pub_date)
+    else:
+        last_post_at = _latest_post_date()
+    Group.objects.filter(pk=group_id).update(
+        posts_count=Greatest(F('posts_count') + delta, 0),
+        last_post_at=last_post_at,
+    )
+
+
+def recount_groups(queryset=None):
+    """Пересчитывает счётчики групп одним UPDATE по таблице постов."""
+    if queryset is None:
+        queryset = Group.objects.all()
+    queryset.update(
+        posts_count=_counted(Post.objects, 'group'),
+        last_post_at=_latest_post_date(),
+    )
+
+
+@transaction.atomic
+def reconcile():
+    """
+    Приводит все счётчики к реальным значениям.
+
+    Возвращает число исправленных строк счётчиков пользователей, постов
+    и групп.
+    """
+    fixed_users = 0
+    for user in real_user_counts().select_related('stats').iterator():
+        stats = getattr(user, 'stats', None)
+        real = (user.real_posts, user.real_followers, user.real_following)
+        if stats is not None and real == (
+                stats.posts_count, stats.followers_count,
+                stats.following_count):
+            continue
+        AuthorStats.objects.update_or_create(user_id=user.pk, defaults=dict(
+            zip(('posts_count', 'followers_count', 'following_count'), real)))
+        fixed_users += 1
+    drifted = Post.objects.annotate(
+        real_comments=_counted(Comment.objects, 'post'),
+    ).exclude(comments_count=F('real_comments'))
+    fixed_posts = 0
+    for post in drifted.only('pk').iterator():
+        Post.objects.filter(pk=post.pk).update(
+            comments_count=post.real_comments)
+        fixed_posts += 1
+    fixed_groups = 0
+    for group in real_group_counts().only(
+            'pk', 'posts_count', 'last_post_at').iterator():
+        real = (group.real_posts, group.real_last_post_at)
+        if real == (group.posts_count, group.last_post_at):
+            continue
+        Group.objects.filter(pk=group.pk).update(
+            posts_count=group.real_posts,
+            last_post_at=group.real_last_post_at)
+        fixed_groups += 1
+    return fixed_users, fixed_posts, fixed_groups
@@ -0,0 +1,95 @@
+"""
+Выгрузка данных пользователя: посты, комментарии, подписки и картинки.
+
+Строки читаются ``.iterator(chunk_size=EXPORT_CHUNK_SIZE)``, а архив
+пишется по мере чтения в поток ответа, поэтому память воркера не зависит
+от числа постов. Записи JSON Lines — в формате команды import_yatube.
+"""
+import json
+import time
+import zipfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .models import Comment, Follow, Post
+
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+
+def export_records(user):
+    """Записи пользователя по одной: посты, комментарии, подписки."""
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    posts = Post.objects.filter(author=user).order_by('pk').values_list(
+        'pk', 'group__slug', 'text', 'pub_date', 'image')
+    for pk, group, text, pub_date, image in posts.iterator(
+            chunk_size=chunk_size):
+        yield {
+            'type': 'post', 'id': pk, 'author': user.username,
+            'group': group, 'text': text, 'pub_date': pub_date.isoformat(),
+            'image': image,
+        }
+    comments = Comment.objects.filter(author=user).order_by(
+        'pk').values_list('post_id', 'text', 'created')
+    for post_id, text, created in comments.iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'comment', 'post': post_id, 'author': user.username,
+            'text': text, 'created': created.isoformat(),
+        }
+    follows = Follow.objects.filter(user=user).order_by('pk').values_list(
+        'author__username', flat=True)
+    for author in follows.iterator(chunk_size=chunk_size):
+        yield {'type': 'follow', 'user': user.username, 'author': author}
+
+
+def jsonl_stream(user):
+    for record in export_records(user):
+        yield (json.dumps(record, ensure_ascii=False) + '\n').encode()
+
+
+class _Pipe:
+    """Файл без перемотки: zipfile пишет в него, генератор забирает."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def zip_stream(user):
+    """ZIP-архив с ``data.jsonl`` и картинками постов в ``images/``."""
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w') as archive:
+        with archive.open(_entry('data.jsonl', zipfile.ZIP_DEFLATED),
+                          'w', force_zip64=True) as data:
+            for line in jsonl_stream(user):
+                data.write(line)
+                yield from pipe.drain()
+        images = Post.objects.filter(author=user).exclude(image='').order_by(
+            'image').values_list('image', flat=True).distinct()
+        for name in images.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            if not default_storage.exists(name):
+                continue
+            # Картинки уже сжаты: кладём как есть.
+            with default_storage.open(name) as image, archive.open(
+                    _entry(f'images/{name}', zipfile.ZIP_STORED),
+                    'w', force_zip64=True) as target:
+                for chunk in image.chunks(IMAGE_CHUNK_SIZE):
+                    target.write(chunk)
+                    yield from pipe.drain()
+    yield from pipe.drain()
+
+
+def _entry(name, compress_type):
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = compress_type
+    return info
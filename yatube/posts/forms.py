@@ -1,5 +1,8 @@
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import keep_original, normalize_image
 from .models import Comment, Post
 
 
@@ -19,6 +22,21 @@ class PostForm(forms.ModelForm):
         }
         fields = ('group', 'text', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Новая загрузка; при правке без файла здесь уже сохранённая.
+        if isinstance(image, UploadedFile):
+            self.original_image = image
+            return normalize_image(image)
+        return image
+
+    def save(self, commit=True):
+        # Исходник пишется, только когда вся форма прошла проверку.
+        original = getattr(self, 'original_image', None)
+        if original is not None and settings.POST_IMAGE_KEEP_ORIGINAL:
+            keep_original(original)
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,120 @@
+"""
+Нормализация картинок, загружаемых в посты.
+
+Картинка декодируется один раз (JPEG — сразу в уменьшенном масштабе
+через ``draft``), поворачивается по EXIF, уменьшается до
+``POST_IMAGE_MAX_SIZE`` по большей стороне и пересохраняется без
+метаданных: непрозрачная — в ``POST_IMAGE_FORMAT``, с прозрачностью —
+в PNG (или WebP), GIF остаётся GIF. Результат пишется во временный
+файл, который уходит на диск, как только перерастает
+``FILE_UPLOAD_MAX_MEMORY_SIZE``.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+ORIGINALS_DIR = 'posts/originals'
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+
+
+def _target_format(source_format, image):
+    if source_format == 'GIF':
+        return 'GIF'
+    if _has_alpha(image):
+        return 'WEBP' if settings.POST_IMAGE_FORMAT == 'WEBP' else 'PNG'
+    return settings.POST_IMAGE_FORMAT
+
+
+def _save_options(image_format):
+    quality = settings.POST_IMAGE_QUALITY
+    return {
+        'JPEG': {'quality': quality, 'optimize': True, 'progressive': True},
+        'WEBP': {'quality': quality},
+        'PNG': {'optimize': True},
+        'GIF': {'optimize': True},
+    }[image_format]
+
+
+def _convert(image, image_format):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+    # PNG и GIF берут EXIF, ICC и комментарии из info: оставляем
+    # только прозрачность палитры.
+    image.info = {
+        key: value for key, value in image.info.items()
+        if key == 'transparency'
+    }
+    return image
+
+
+def keep_original(upload):
+    """Сохраняет загруженный файл как есть в ``ORIGINALS_DIR``."""
+    upload.seek(0)
+    default_storage.save(
+        f'{ORIGINALS_DIR}/{os.path.basename(upload.name)}', upload)
+
+
+def normalize_image(upload):
+    """
+    Возвращает файл уменьшенной картинки без метаданных.
+
+    Слишком большие файлы и картинки с числом пикселей больше
+    ``POST_IMAGE_MAX_PIXELS`` (защита от «бомб» распаковки) отклоняются
+    до декодирования. Анимированные GIF, которые уже помещаются в
+    ограничения, сохраняются как есть, чтобы не потерять анимацию.
+    """
+    if upload.size > settings.POST_IMAGE_MAX_UPLOAD_SIZE:
+        raise ValidationError(
+            'Файл больше %(limit)s.',
+            params={'limit': filesizeformat(
+                settings.POST_IMAGE_MAX_UPLOAD_SIZE)},
+            code='file_too_large',
+        )
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    upload.seek(0)
+    # Открытие читает только заголовок: пиксели ещё не декодированы.
+    try:
+        image = Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Не удалось прочитать картинку.', code='invalid_image')
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Слишком большое разрешение: %(width)s×%(height)s.',
+            params={'width': width, 'height': height},
+            code='too_many_pixels',
+        )
+    if getattr(image, 'is_animated', False) and max(width, height) <= (
+            max_size):
+        upload.seek(0)
+        return upload
+    source_format = image.format
+    image.draft('RGB', (max_size, max_size))
+    try:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    except (OSError, SyntaxError, ValueError):
+        raise ValidationError(
+            'Не удалось прочитать картинку.', code='invalid_image')
+    image_format = _target_format(source_format, image)
+    image = _convert(image, image_format)
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    image.save(output, image_format, **_save_options(image_format))
+    output.seek(0)
+    name, _ = os.path.splitext(os.path.basename(upload.name))
+    return File(output, name=f'{name}.{EXTENSIONS[image_format]}')
@@ -0,0 +1,350 @@
+"""
+Потоковый импорт постов, комментариев и подписок из JSONL или CSV.
+
+Файл читается построчно, записи копятся пачками по ``batch_size`` и
+пишутся ``bulk_create`` в отдельной транзакции вместе с точкой
+продолжения (``ImportCheckpoint``). В той же транзакции досчитывается
+то, что при обычной записи делают сигналы, — но только для строк пачки:
+счётчики, ленты подписок и поисковый индекс. В памяти держатся только
+текущая пачка и справочники «имя пользователя → id» и «slug группы → id».
+
+Форматы записей (в CSV — столбцы с теми же именами)::
+
+    {"type": "post", "id": 17, "author": "leo", "group": "cats",
+     "text": "...", "pub_date": "2022-12-01T10:00:00+00:00", "image": ""}
+    {"type": "comment", "post": 17, "author": "kate", "text": "...",
+     "created": "2022-12-01T11:00:00+00:00"}
+    {"type": "follow", "user": "kate", "author": "leo"}
+
+``id`` поста сохраняется как его первичный ключ, чтобы комментарии
+могли ссылаться на посты без таблицы соответствия в памяти; постам без
+``id`` ключи выдаются здесь же, следом за последним.
+"""
+import csv
+import itertools
+import json
+import os
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.caching import bump_tags
+
+from . import counters, search, timeline
+from .models import Comment, Follow, Group, ImportCheckpoint, Post, User
+from .seeding import next_id, explicit_dates
+from .utils import chunked, invalidate_feed_counts
+
+RECORD_TYPES = ('post', 'comment', 'follow')
+
+
+class ImportErrorRecord(Exception):
+    """Запись, которую нельзя загрузить; импорт её пропускает."""
+
+
+def read_records(path, record_type=None):
+    """Записи файла по одной: JSONL или CSV (по расширению)."""
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(source):
+                row.setdefault('type', record_type)
+                yield row
+            return
+        for line in source:
+            if not line.strip():
+                yield {}
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = {'type': None}
+            if record_type and isinstance(record, dict):
+                record.setdefault('type', record_type)
+            yield record
+
+
+class Importer:
+
+    def __init__(self, path, record_type=None, batch_size=2000,
+                 resume=True, log=None):
+        self.path = path
+        self.record_type = record_type
+        self.batch_size = batch_size
+        self.resume = resume
+        self.log = log or (lambda message: None)
+        self.source = os.path.abspath(path)
+        self.users = {}
+        self.groups = {}
+        self.password = make_password(None)
+        self.stats = dict.fromkeys(
+            ('post', 'comment', 'follow', 'skipped', 'users', 'groups'), 0)
+        # Чьи страницы и ленты устарели в текущей пачке: их сбрасываем
+        # после её коммита, так что наборы не растут с размером файла.
+        self.authors = set()
+        self.touched_users = set()
+        self.touched_groups = set()
+        self.followers = set()
+        self.commented_posts = set()
+
+    def run(self):
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(
+            source=self.source)
+        if not self.resume:
+            checkpoint.position = 0
+        position = checkpoint.position
+        if position:
+            self.log(f'Продолжаем с записи {position + 1}')
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        records = itertools.islice(
+            read_records(self.path, self.record_type), position, None)
+        for batch in iter(lambda: list(
+                itertools.islice(records, self.batch_size)), []):
+            with transaction.atomic():
+                self.write(batch, position)
+                position += len(batch)
+                ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(
+                    position=position, updated=timezone.now())
+            self.invalidate_caches()
+            # При DEBUG Django копит тексты запросов: не даём им расти.
+            reset_queries()
+            self.log(f'Загружено записей: {position}')
+        self.finish()
+        return self.stats
+
+    def write(self, batch, position):
+        posts, comments, follows = [], [], []
+        for number, record in enumerate(batch, position + 1):
+            try:
+                kind = record.get('type') if isinstance(record, dict) else None
+                if kind == 'post':
+                    posts.append(self.build_post(record))
+                elif kind == 'comment':
+                    comments.append(self.build_comment(record))
+                elif kind == 'follow':
+                    follows.append(self.build_follow(record))
+                elif record:
+                    raise ImportErrorRecord(f'неизвестный тип {kind!r}')
+            except ImportErrorRecord as error:
+                self.stats['skipped'] += 1
+                self.log(f'Запись {number} пропущена: {error}')
+        posts = self.new_posts(posts)
+        self.assign_ids(posts)
+        with explicit_dates(Post._meta.get_field('pub_date'),
+                            Comment._meta.get_field('created')):
+            Post.objects.bulk_create(posts)
+            post_ids = set()
+            for chunk in chunked({comment.post_id for comment in comments}):
+                post_ids.update(Post.objects.filter(
+                    pk__in=chunk).values_list('pk', flat=True))
+            known = [c for c in comments if c.post_id in post_ids]
+            self.stats['skipped'] += len(comments) - len(known)
+            Comment.objects.bulk_create(known)
+        self.count_posts(posts)
+        self.count_comments(known)
+        for chunk in chunked(post.pk for post in posts):
+            new_posts = Post.objects.filter(pk__in=chunk)
+            timeline.fan_out_many(new_posts)
+            search.index_posts(new_posts)
+        follows = self.new_follows(follows)
+        # Новые подписки получают id после всех прежних.
+        last_follow = next_id(Follow) - 1
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        self.count_follows(follows)
+        timeline.backfill_many(Follow.objects.filter(pk__gt=last_follow))
+        self.authors = {post.author_id for post in posts}
+        self.touched_users = self.authors.union(
+            itertools.chain.from_iterable(
+                (follow.user_id, follow.author_id) for follow in follows))
+        self.touched_groups = {
+            post.group_id for post in posts if post.group_id}
+        self.followers = {follow.user_id for follow in follows}
+        self.commented_posts = {comment.post_id for comment in known}
+        self.stats['post'] += len(posts)
+        self.stats['comment'] += len(known)
+        self.stats['follow'] += len(follows)
+
+    def new_posts(self, posts):
+        """
+        Посты пачки без тех, чей id уже занят (в базе или раньше в той же
+        пачке): их импорт пропускает, а не падает на первичном ключе.
+        """
+        taken = set()
+        for chunk in chunked({post.pk for post in posts if post.pk}):
+            taken.update(Post.objects.filter(
+                pk__in=chunk).values_list('pk', flat=True))
+        new = []
+        for post in posts:
+            if post.pk in taken:
+                self.stats['skipped'] += 1
+                self.log(f'Пост {post.pk} пропущен: id уже занят')
+                continue
+            if post.pk:
+                taken.add(post.pk)
+            new.append(post)
+        return new
+
+    @staticmethod
+    def assign_ids(posts):
+        """Выдаёт id постам, у которых его нет в файле."""
+        missing = [post for post in posts if post.pk is None]
+        if not missing:
+            return
+        given = max((post.pk for post in posts if post.pk), default=0)
+        first = max(next_id(Post), given + 1)
+        for pk, post in enumerate(missing, first):
+            post.pk = pk
+
+    def new_follows(self, follows):
+        """Подписки пачки без повторов и без тех, что уже есть."""
+        pairs = {(follow.user_id, follow.author_id) for follow in follows}
+        for chunk in chunked({user_id for user_id, _ in pairs}):
+            pairs.difference_update(Follow.objects.filter(
+                user_id__in=chunk).values_list('user_id', 'author_id'))
+        return [Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in sorted(pairs)]
+
+    @staticmethod
+    def count_posts(posts):
+        """Сдвигает счётчики авторов и групп, как это сделали бы сигналы."""
+        per_author, per_group = {}, {}
+        for post in posts:
+            per_author[post.author_id] = per_author.get(post.author_id, 0) + 1
+            if post.group_id:
+                count, latest = per_group.get(post.group_id, (0, None))
+                per_group[post.group_id] = (
+                    count + 1, max(latest or post.pub_date, post.pub_date))
+        counters.add_user_counts('posts_count', per_author)
+        for group_id, (count, latest) in per_group.items():
+            counters.change_group_counters(group_id, count, latest)
+
+    @staticmethod
+    def count_comments(comments):
+        """Сдвигает comments_count постов, как это сделал бы сигнал."""
+        per_post = {}
+        for comment in comments:
+            per_post[comment.post_id] = per_post.get(comment.post_id, 0) + 1
+        counters.add_counts(Post.objects, 'comments_count', per_post)
+
+    @staticmethod
+    def count_follows(follows):
+        """Сдвигает счётчики подписок обеих сторон."""
+        followers, following = {}, {}
+        for follow in follows:
+            followers[follow.author_id] = (
+                followers.get(follow.author_id, 0) + 1)
+            following[follow.user_id] = following.get(follow.user_id, 0) + 1
+        counters.add_user_counts('followers_count', followers)
+        counters.add_user_counts('following_count', following)
+
+    def finish(self):
+        # id постов пришли из файла: последовательность (не в SQLite)
+        # должна продолжиться после них.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Post]):
+                cursor.execute(sql)
+
+    def invalidate_caches(self):
+        """
+        Сбрасывает страницы и счётчики лент, которых коснулась пачка, как
+        это сделали бы сигналы; остальной кеш (пределы частоты, готовность
+        превью, карточки) остаётся.
+        """
+        usernames, slugs, followers = [], [], set(self.followers)
+        for chunk in chunked(self.touched_users):
+            usernames += User.objects.filter(pk__in=chunk).values_list(
+                'username', flat=True)
+        for chunk in chunked(self.touched_groups):
+            slugs += Group.objects.filter(pk__in=chunk).values_list(
+                'slug', flat=True)
+        # Новые посты попали в ленты подписок читателей их авторов.
+        for chunk in chunked(self.authors):
+            followers.update(Follow.objects.filter(
+                author_id__in=chunk).values_list('user_id', flat=True))
+        bump_tags(
+            'feed:index', 'groups',
+            *(f'group:{slug}' for slug in slugs),
+            *(f'author:{username}' for username in usernames),
+            *(f'post:{pk}' for pk in self.commented_posts),
+        )
+        invalidate_feed_counts(
+            'index', 'groups',
+            *(f'group:{pk}' for pk in self.touched_groups),
+            *(f'author:{pk}' for pk in self.touched_users),
+            *(f'follow:{pk}' for pk in followers),
+        )
+
+    def user_id(self, username):
+        if not username:
+            raise ImportErrorRecord('не указан пользователь')
+        if username not in self.users:
+            user = User.objects.create(
+                username=username, password=self.password)
+            self.users[username] = user.pk
+            self.stats['users'] += 1
+        return self.users[username]
+
+    def group_id(self, slug):
+        if not slug:
+            return None
+        if slug not in self.groups:
+            group = Group.objects.create(title=slug, slug=slug)
+            self.groups[slug] = group.pk
+            self.stats['groups'] += 1
+        return self.groups[slug]
+
+    @staticmethod
+    def date(value):
+        if not value:
+            return timezone.now()
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ImportErrorRecord(f'неверная дата {value!r}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def build_post(self, record):
+        if not record.get('text'):
+            raise ImportErrorRecord('пустой текст поста')
+        post_id = record.get('id') or None
+        if post_id is not None:
+            try:
+                post_id = int(post_id)
+            except ValueError:
+                raise ImportErrorRecord(f'неверный id {post_id!r}')
+        return Post(
+            pk=post_id,
+            text=record['text'],
+            pub_date=self.date(record.get('pub_date')),
+            author_id=self.user_id(record.get('author')),
+            group_id=self.group_id(record.get('group')),
+            image=record.get('image') or '',
+        )
+
+    def build_comment(self, record):
+        if not record.get('text'):
+            raise ImportErrorRecord('пустой текст комментария')
+        try:
+            post_id = int(record.get('post'))
+        except (TypeError, ValueError):
+            raise ImportErrorRecord('не указан пост')
+        return Comment(
+            post_id=post_id,
+            text=record['text'],
+            created=self.date(record.get('created')),
+            author_id=self.user_id(record.get('author')),
+        )
+
+    def build_follow(self, record):
+        user = self.user_id(record.get('user'))
+        author = self.user_id(record.get('author'))
+        if user == author:
+            raise ImportErrorRecord('подписка на самого себя')
+        return Follow(user_id=user, author_id=author)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.suggestions import Builder
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации «кого почитать»'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать всех, а не только тех, чьи подписки менялись',
+        )
+
+    def handle(self, *args, **options):
+        users = Builder(full=options['full'], log=self.stdout.write).run()
+        self.stdout.write(self.style.SUCCESS(
+            f'Рекомендации пересчитаны, пользователей: {users}'))
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие превью всех размеров для картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.THUMBNAIL_WORKERS,
+            help='Сколько картинок обрабатывать параллельно',
+        )
+
+    def handle(self, *args, **options):
+        # Разных картинок гораздо меньше, чем постов: список помещается
+        # в память, а pool.map всё равно забирает его целиком.
+        names = list(Post.objects.exclude(image='').order_by(
+            'image').values_list('image', flat=True).distinct())
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            # Готовые превью не пересоздаются: повторный запуск дешёвый.
+            for name, result in zip(names, pool.map(self.generate, names)):
+                if isinstance(result, Exception):
+                    failed += 1
+                    self.stderr.write(f'{name}: {result}')
+                    continue
+                done += 1
+                # Теги страниц сбрасываются здесь: потокам пула база
+                # не нужна.
+                if result:
+                    thumbnails.refresh_pages(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок обработано: {done}, с ошибками: {failed}'))
+
+    @staticmethod
+    def generate(name):
+        try:
+            return thumbnails.create_thumbnails(name)
+        except Exception as error:
+            return error
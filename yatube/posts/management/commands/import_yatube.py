@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importing import RECORD_TYPES, Importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково загружает посты, комментарии и подписки из JSONL или CSV '
+        'с продолжением после сбоя'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .jsonl или .csv')
+        parser.add_argument(
+            '--type', choices=RECORD_TYPES,
+            help='Тип записей, если его нет в самих записях (для CSV)',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать файл заново, а не с сохранённой точки',
+        )
+
+    def handle(self, *args, **options):
+        if options['path'].endswith('.csv') and not options['type']:
+            raise CommandError('Для CSV укажите --type')
+        try:
+            stats = Importer(
+                options['path'],
+                record_type=options['type'],
+                batch_size=options['batch_size'],
+                resume=not options['restart'],
+                log=self.stdout.write,
+            ).run()
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Постов: {stats["post"]}, комментариев: {stats["comment"]}, '
+            f'подписок: {stats["follow"]}, пропущено: {stats["skipped"]}; '
+            f'создано пользователей: {stats["users"]}, '
+            f'групп: {stats["groups"]}'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс постов'
+
+    def handle(self, *args, **options):
+        if not search.enabled():
+            self.stdout.write(
+                'Индекс нужен только для SQLite, здесь поиск идёт по LIKE')
+            return
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс пересобран, постов: {indexed}'))
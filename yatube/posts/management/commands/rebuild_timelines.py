@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок из Follow и Post или ищет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить ленты, при расхождении завершиться ошибкой',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            timeline.rebuild()
+            self.stdout.write(self.style.SUCCESS('Ленты подписок пересобраны'))
+            return
+        stale = timeline.stale_entries().count()
+        missing = sum(1 for _ in timeline.missing_entries())
+        if stale or missing:
+            raise CommandError(
+                f'Ленты расходятся с подписками: лишних записей {stale}, '
+                f'недостающих {missing}'
+            )
+        self.stdout.write(self.style.SUCCESS('Ленты подписок согласованы'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Сверяет хранимые счётчики постов, подписок, комментариев и групп'
+
+    def handle(self, *args, **options):
+        fixed_users, fixed_posts, fixed_groups = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков пользователей: {fixed_users}, '
+            f'постов: {fixed_posts}, групп: {fixed_groups}'
+        ))
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.seeding import Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетический набор данных заданного объёма '
+        'для проверки производительности'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows', type=int, default=5000,
+            help='Подписок; в ленты попадает до TIMELINE_BACKFILL_SIZE '
+                 'постов автора на каждую, это самая долгая часть',
+        )
+        parser.add_argument(
+            '--images', type=int, default=0,
+            help='Сколько постов получат картинку',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределить посты',
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель закона Ципфа для авторов и подписок',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=42,
+            help='Зерно генератора: одинаковое зерно — одинаковые данные',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        Seeder(
+            users=options['users'],
+            groups=options['groups'],
+            posts=options['posts'],
+            comments=options['comments'],
+            follows=options['follows'],
+            images=options['images'],
+            days=options['days'],
+            skew=options['skew'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        ).run()
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.monotonic() - started:.1f} с'))
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, unique=True, verbose_name='Источник')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Загружено записей')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Точка продолжения импорта',
+                'verbose_name_plural': 'Точки продолжения импорта',
+            },
+        ),
+    ]
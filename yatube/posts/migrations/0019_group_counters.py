@@ -0,0 +1,39 @@
+# Generated by Django 2.2.16 on 2026-10-18 21:42
+
+from django.db import migrations, models
+
+
+def fill_group_counters(apps, schema_editor):
+    Group = apps.get_model('posts', 'Group')
+    Post = apps.get_model('posts', 'Post')
+    stats = Post.objects.filter(group__isnull=False).order_by().values(
+        'group_id').annotate(total=models.Count('pk'),
+                             latest=models.Max('pub_date'))
+    for row in stats:
+        Group.objects.filter(pk=row['group_id']).update(
+            posts_count=row['total'], last_post_at=row['latest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_follow_suggestions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='last_post_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последний пост'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Постов'),
+        ),
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['title'], name='group_title_idx'),
+        ),
+        migrations.RunPython(fill_group_counters, migrations.RunPython.noop),
+    ]
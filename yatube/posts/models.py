@@ -4,16 +4,54 @@ from django.db import models
 User = get_user_model()
 
 
-class Group(models.Model):
+class KeepCountersMixin:
+    """
+    Правка объекта (в админке, формой, из кода) не переписывает
+    хранимые счётчики ``COUNTER_FIELDS`` значениями, прочитанными до
+    сдвигов из сигналов: сохраняются только остальные поля.
+    """
+    COUNTER_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(KeepCountersMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    # Хранимые счётчики для каталога групп; сдвигаются сигналами постов,
+    # сверяются командой reconcile_counters.
+    posts_count = models.PositiveIntegerField(
+        'Постов',
+        default=0,
+        editable=False
+    )
+    last_post_at = models.DateTimeField(
+        'Последний пост',
+        null=True,
+        blank=True,
+        editable=False
+    )
+
+    COUNTER_FIELDS = ('posts_count', 'last_post_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['title'], name='group_title_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class Post(KeepCountersMixin, models.Model):
     text = models.TextField(
         'Текст поста',
         help_text='Введите текст поста'
@@ -42,11 +80,32 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
+
+    COUNTER_FIELDS = ('comments_count',)
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы по возрастанию: SQLite читает их в обратном порядке,
+        # и сортировка лент по (-pub_date, -id) обходится без TEMP B-TREE.
+        indexes = [
+            models.Index(fields=['pub_date'], name='post_pub_date_idx'),
+            models.Index(
+                fields=['group', 'pub_date'], name='post_group_pub_date_idx'),
+            models.Index(
+                fields=['author', 'pub_date'],
+                name='post_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -72,6 +131,12 @@ class Comment(models.Model):
         auto_now_add=True
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', 'created'], name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return self.text[:15]
 
@@ -99,3 +164,149 @@ class Follow(models.Model):
                 fields=['user', 'author'],
                 name='unique_follow')
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """
+    Счётчики пользователя, которые иначе пришлось бы считать COUNT(*).
+
+    Меняются атомарно через F() при создании и удалении постов и
+    подписок; расхождения чинит команда reconcile_counters.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='stats',
+        verbose_name='пользователь'
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return f'{self.user}: {self.posts_count} постов'
+
+
+class TimelineEntry(models.Model):
+    """
+    Запись ленты подписок: пост автора, на которого подписан пользователь.
+
+    Заполняется при публикации поста (fan-out on write), поэтому лента
+    подписок читается одним диапазоном по индексу (user, pub_date).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='пост'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    def __str__(self):
+        return f'{self.user}: {self.post}'
+
+    class Meta:
+        ordering = ['-pub_date', '-pk']
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry')
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'pub_date'],
+                name='timeline_user_pub_date_idx')
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Сколько записей файла уже загрузила команда import_yatube.
+
+    Сдвигается в той же транзакции, что и сама пачка записей, поэтому
+    после сбоя импорт продолжается ровно с первой незагруженной записи.
+    """
+    source = models.CharField('Источник', max_length=500, unique=True)
+    position = models.BigIntegerField('Загружено записей', default=0)
+    updated = models.DateTimeField('Обновлено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Точка продолжения импорта'
+        verbose_name_plural = 'Точки продолжения импорта'
+
+    def __str__(self):
+        return f'{self.source}: {self.position}'
+
+
+class FollowSuggestion(models.Model):
+    """
+    Автор, на которого стоит подписаться: его читают те, кого читает
+    пользователь. Таблицу заполняет команда build_suggestions.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='follow_suggestions',
+        verbose_name='пользователь'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='автор'
+    )
+    mutual = models.PositiveIntegerField('Общих подписок', default=0)
+    score = models.FloatField('Оценка')
+
+    def __str__(self):
+        return f'{self.user} → {self.author}'
+
+    class Meta:
+        ordering = ['-score']
+        verbose_name = 'Рекомендация автора'
+        verbose_name_plural = 'Рекомендации авторов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_follow_suggestion')
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'score'], name='suggestion_user_score_idx'),
+        ]
+
+
+class SuggestionUpdate(models.Model):
+    """
+    Пользователь, чьи подписки изменились после последнего пересчёта
+    рекомендаций: его и его подписчиков пересчитает build_suggestions.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='пользователь'
+    )
+
+    def __str__(self):
+        return str(self.user)
+
+    class Meta:
+        verbose_name = 'Изменение подписок'
+        verbose_name_plural = 'Изменения подписок'
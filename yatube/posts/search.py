@@ -0,0 +1,143 @@
+"""
+Полнотекстовый поиск по постам.
+
+На SQLite индекс — виртуальная таблица FTS5 ``posts_post_fts`` с
+``rowid``, равным id поста; сигналы обновляют её при создании,
+изменении и удалении постов, команда ``rebuild_search_index``
+пересобирает целиком. На других СУБД поиск сводится к ``icontains``.
+"""
+import re
+
+from django.db import connection
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+# Слова запроса; операторы FTS5 из пользовательского ввода не нужны.
+TERM = re.compile(r'\w+')
+
+
+def enabled():
+    return connection.vendor == 'sqlite'
+
+
+def to_match(query):
+    """
+    Превращает ввод пользователя в выражение MATCH: все слова должны
+    встретиться, последнее — как префикс («джан» найдёт «django»).
+    """
+    terms = TERM.findall(query.lower())
+    if not terms:
+        return ''
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def index_post(post):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text])
+
+
+def unindex_post(post_id):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def index_posts(posts):
+    """
+    Добавляет в индекс новые посты из queryset ``posts`` одним
+    INSERT ... SELECT: так индексируются посты, загруженные пачкой.
+    """
+    if not enabled():
+        return
+    sql, params = posts.order_by().values(
+        'pk', 'text').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) {sql}', params)
+
+
+def rebuild():
+    """Пересобирает индекс по всем постам; возвращает их число."""
+    if not enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        index_posts(Post.objects.all())
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) "
+                       "VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def filter_posts(queryset, query):
+    """Посты ``queryset``, подходящие под запрос (без ранжирования)."""
+    if not enabled():
+        for term in TERM.findall(query):
+            queryset = queryset.filter(text__icontains=term)
+        return queryset
+    match = to_match(query)
+    if not match:
+        return queryset.none()
+    return queryset.extra(
+        where=[f'{Post._meta.db_table}.id IN ('
+               f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'],
+        params=[match],
+    )
+
+
+class SearchResults:
+    """
+    Результаты поиска по убыванию релевантности (BM25) для Paginator:
+    число строк и нужный срез берутся прямо из индекса, а посты страницы
+    загружаются одним запросом.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.match = to_match(query) if enabled() else ''
+
+    def count(self):
+        if not enabled():
+            return self._fallback().count()
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s', [self.match])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if not enabled():
+            return list(self._fallback()[index])
+        if not self.match:
+            return []
+        start = index.start or 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                'ORDER BY rank, rowid DESC LIMIT %s OFFSET %s',
+                [self.match, index.stop - start, start])
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = Post.objects.select_related('author', 'group').in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+    def _fallback(self):
+        return filter_posts(
+            Post.objects.select_related('author', 'group'), self.query)
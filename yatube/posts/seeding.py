@@ -0,0 +1,267 @@
+"""
+Синтетические данные производственного объёма для проверки
+производительности: пользователи, группы, посты, комментарии и подписки.
+
+Всё создаётся через ``bulk_create`` пачками, минуя сигналы, поэтому
+счётчики, ленты подписок и поисковый индекс дополняются здесь же только
+новыми строками, а в кеше сбрасываются общие ленты.
+Случайность задаётся одним зерном, так что набор воспроизводим.
+"""
+import io
+import itertools
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from core.caching import bump_tags
+
+from . import counters, search, thumbnails, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .utils import invalidate_feed_counts
+
+WORDS = (
+    'пост текст группа лента автор подписка комментарий новость день '
+    'город работа дом книга фильм музыка спорт кот собака погода утро '
+    'вечер друзья отпуск море горы код python django кеш запрос база '
+    'страница картинка фото история идея вопрос ответ план итог неделя'
+).split()
+SEED_PASSWORD = 'seed-password'
+# Разных картинок немного: одинаковые файлы делят превью, как в жизни.
+SEED_IMAGES = 20
+
+
+def _zipf_cum_weights(count, exponent):
+    """Накопленные веса закона Ципфа: k-й по популярности ~ 1 / k**s."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Даёт задать даты с auto_now_add: иначе все они станут «сейчас»."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Seeder:
+    """
+    Генератор набора данных.
+
+    Авторы постов и комментариев выбираются по закону Ципфа (немногие
+    пишут большую часть постов), на популярных авторов подписываются
+    чаще — граф подписок получается степенным.
+    """
+
+    def __init__(self, users=1000, groups=20, posts=10000, comments=20000,
+                 follows=5000, images=0, days=365, skew=1.1, seed=42,
+                 batch_size=5000, log=None):
+        self.users = users
+        self.groups = groups
+        self.posts = posts
+        self.comments = comments
+        self.follows = follows
+        self.images = images
+        self.days = days
+        self.skew = skew
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=days)
+        self.step = timedelta(days=days) / max(posts, 1)
+        self.log = log or (lambda message: None)
+
+    def run(self):
+        if connection.vendor == 'sqlite':
+            # Индексы на миллионы строк не влезают в кеш страниц
+            # по умолчанию (2 МБ), и каждая вставка читает диск.
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA cache_size = -524288')
+        with transaction.atomic():
+            user_ids = self.create_users()
+            group_ids = self.create_groups()
+            follows = self.create_follows(user_ids)
+            images = self.create_images()
+            post_authors, post_ids = self.create_posts(
+                user_ids, group_ids, images)
+            self.create_comments(user_ids, post_ids)
+            self.create_stats(user_ids, post_authors, follows)
+            counters.recount_groups(
+                Group.objects.filter(pk__gte=group_ids.start))
+            # Подписки и посты есть только у новых пользователей: ленты
+            # и индекс дополняются ими, прежние строки не пересобираются.
+            self.log('Заполнение лент подписок')
+            timeline.backfill_many(
+                Follow.objects.filter(user_id__gte=user_ids.start))
+            self.log('Индексация постов для поиска')
+            search.index_posts(Post.objects.filter(pk__gte=post_ids.start))
+        for name in images:
+            thumbnails.create_thumbnails(name)
+        # Пользователи, группы и подписки — все новые, их страниц в кеше
+        # нет; устарели только общие ленты. Сбрасываются после превью,
+        # чтобы ленты не закешировались с заглушками.
+        bump_tags('feed:index', 'groups')
+        invalidate_feed_counts('index', 'groups')
+
+    def _bulk(self, model, objects):
+        created = 0
+        for batch in iter(lambda: list(
+                itertools.islice(objects, self.batch_size)), []):
+            # Размер одного INSERT Django подбирает сам под пределы СУБД.
+            model.objects.bulk_create(batch)
+            created += len(batch)
+        self.log(f'{model._meta.verbose_name_plural}: {created}')
+
+    def _text(self, low, high):
+        return ' '.join(self.random.choices(
+            WORDS, k=self.random.randint(low, high))).capitalize()
+
+    def create_users(self):
+        first = next_id(User)
+        password = make_password(SEED_PASSWORD)
+        ids = range(first, first + self.users)
+        self._bulk(User, (
+            User(pk=pk, username=f'seed_user_{pk}', password=password)
+            for pk in ids))
+        return ids
+
+    def create_groups(self):
+        first = next_id(Group)
+        ids = range(first, first + self.groups)
+        self._bulk(Group, (
+            Group(pk=pk, title=f'Группа {pk}', slug=f'seed-group-{pk}',
+                  description=self._text(5, 30))
+            for pk in ids))
+        return ids
+
+    def create_follows(self, user_ids):
+        """Возвращает множество пар (подписчик, автор)."""
+        if len(user_ids) < 2:
+            return set()
+        weights = _zipf_cum_weights(len(user_ids), self.skew)
+        follows = set()
+        limit = len(user_ids) * (len(user_ids) - 1)
+        target = min(self.follows, limit)
+        while len(follows) < target:
+            authors = self.random.choices(
+                user_ids, cum_weights=weights, k=target - len(follows))
+            for author in authors:
+                user = self.random.choice(user_ids)
+                if user != author:
+                    follows.add((user, author))
+        self._bulk(Follow, (
+            Follow(user_id=user, author_id=author)
+            for user, author in sorted(follows)))
+        return follows
+
+    def create_images(self):
+        if not self.images:
+            return []
+        names = []
+        for number in range(min(self.images, SEED_IMAGES)):
+            color = tuple(self.random.randrange(256) for _ in range(3))
+            content = io.BytesIO()
+            Image.new('RGB', (1200, 800), color).save(content, 'JPEG')
+            names.append(default_storage.save(
+                f'posts/seed_{number}.jpg', ContentFile(content.getvalue())))
+        return names
+
+    def post_date(self, number):
+        return self.start + self.step * number
+
+    def create_posts(self, user_ids, group_ids, images):
+        """
+        Возвращает авторов постов по порядку и диапазон их id.
+
+        Даты растут вместе с id, как у постов, публикуемых по одному.
+        """
+        first = next_id(Post)
+        ids = range(first, first + self.posts)
+        authors = self.random.choices(
+            user_ids, cum_weights=_zipf_cum_weights(len(user_ids), self.skew),
+            k=self.posts) if user_ids else []
+        with_image = set(self.random.sample(
+            range(self.posts), min(self.images, self.posts)))
+
+        def posts():
+            for number, author in enumerate(authors):
+                group = (self.random.choice(group_ids)
+                         if group_ids and self.random.random() < 0.6 else None)
+                yield Post(
+                    pk=first + number,
+                    text=self._text(3, 60),
+                    pub_date=self.post_date(number),
+                    author_id=author,
+                    group_id=group,
+                    image=(self.random.choice(images)
+                           if number in with_image else ''),
+                )
+
+        with explicit_dates(Post._meta.get_field('pub_date')):
+            self._bulk(Post, posts())
+        return authors, ids
+
+    def create_comments(self, user_ids, post_ids):
+        """Комментарии к популярным постам с датой после поста."""
+        if not post_ids or not user_ids:
+            return
+        posts = self.random.choices(
+            post_ids, cum_weights=_zipf_cum_weights(len(post_ids), 0.8),
+            k=self.comments)
+        authors = self.random.choices(
+            user_ids, cum_weights=_zipf_cum_weights(len(user_ids), self.skew),
+            k=self.comments)
+        comments = (
+            Comment(
+                post_id=post, author_id=author, text=self._text(1, 25),
+                created=min(self.end, self.post_date(
+                    post - post_ids.start) + timedelta(
+                        minutes=self.random.randrange(60 * 24))),
+            )
+            for post, author in zip(posts, authors)
+        )
+        with explicit_dates(Comment._meta.get_field('created')):
+            self._bulk(Comment, comments)
+        counts = {}
+        for post in posts:
+            counts[post] = counts.get(post, 0) + 1
+        by_count = {}
+        for post, count in counts.items():
+            by_count.setdefault(count, []).append(post)
+        for count, pks in by_count.items():
+            for start in range(0, len(pks), self.batch_size):
+                Post.objects.filter(
+                    pk__in=pks[start:start + self.batch_size],
+                ).update(comments_count=count)
+
+    def create_stats(self, user_ids, post_authors, follows):
+        posts, followers, following = {}, {}, {}
+        for author in post_authors:
+            posts[author] = posts.get(author, 0) + 1
+        for user, author in follows:
+            followers[author] = followers.get(author, 0) + 1
+            following[user] = following.get(user, 0) + 1
+        self._bulk(AuthorStats, (
+            AuthorStats(
+                user_id=pk,
+                posts_count=posts.get(pk, 0),
+                followers_count=followers.get(pk, 0),
+                following_count=following.get(pk, 0),
+            )
+            for pk in user_ids))
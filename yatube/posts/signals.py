@@ -0,0 +1,136 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.caching import bump_tags
+
+from . import counters, search, suggestions, thumbnails, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .utils import invalidate_feed_counts
+
+
+def _post_feeds(post, *group_ids):
+    feeds = ['index', f'author:{post.author_id}']
+    feeds += [f'group:{group_id}' for group_id in group_ids if group_id]
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    feeds += [f'follow:{user_id}' for user_id in followers]
+    return feeds
+
+
+def _post_tags(post, *group_slugs):
+    tags = ['feed:index', f'author:{post.author.username}', f'post:{post.pk}']
+    tags += [f'group:{slug}' for slug in group_slugs if slug]
+    return tags
+
+
+def _move_between_groups(post, from_group_id, to_group=True):
+    """Сдвигает счётчики групп, которые пост покинул или пополнил."""
+    changed = False
+    if from_group_id:
+        counters.change_group_counters(from_group_id, -1)
+        changed = True
+    if to_group and post.group_id:
+        counters.change_group_counters(post.group_id, 1, post.pub_date)
+        changed = True
+    if changed:
+        bump_tags('groups')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+        suggestions.mark_changed(instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_post(sender, instance, **kwargs):
+    """
+    Запоминает прежние группу и картинку поста: кеш старой группы нужно
+    сбросить, а превью — создать только для новой картинки.
+    """
+    instance._previous = (None, None, '')
+    if instance.pk is not None:
+        instance._previous = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'group__slug', 'image').first()
+            or (None, None, ''))
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_counters(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+    search.index_post(instance)
+    previous_group_id, previous_slug, previous_image = getattr(
+        instance, '_previous', (None, None, ''))
+    if created or previous_group_id != instance.group_id:
+        _move_between_groups(
+            instance, None if created else previous_group_id)
+    if instance.image and instance.image.name != previous_image:
+        thumbnails.schedule_thumbnails(instance.image.name)
+    group_slug = instance.group.slug if instance.group_id else None
+    bump_tags(*_post_tags(instance, group_slug, previous_slug))
+    if not created and previous_group_id == instance.group_id:
+        return
+    invalidate_feed_counts(
+        *_post_feeds(instance, instance.group_id, previous_group_id))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user_counters(instance.author_id, posts_count=-1)
+    _move_between_groups(instance, instance.group_id, to_group=False)
+    search.unindex_post(instance.pk)
+    group_slug = instance.group.slug if instance.group_id else None
+    bump_tags(*_post_tags(instance, group_slug))
+    invalidate_feed_counts(*_post_feeds(instance, instance.group_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_count(instance.post_id, 1)
+    bump_tags(f'post:{instance.post_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_comments_count(instance.post_id, -1)
+    bump_tags(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    bump_tags('feed:index', f'group:{instance.slug}', 'groups')
+    invalidate_feed_counts('groups')
+
+
+def _bump_follow_tags(follow):
+    # Профиль автора показывает подписчиков, профиль читателя — подписки.
+    bump_tags(f'author:{follow.author.username}',
+              f'author:{follow.user.username}')
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_counters(instance.author_id, followers_count=1)
+        counters.change_user_counters(instance.user_id, following_count=1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        suggestions.mark_changed(instance.user_id)
+        suggestions.drop_suggestion(instance.user_id, instance.author_id)
+    _bump_follow_tags(instance)
+    invalidate_feed_counts(f'follow:{instance.user_id}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_counters(instance.author_id, followers_count=-1)
+    counters.change_user_counters(instance.user_id, following_count=-1)
+    timeline.prune(instance.user_id, instance.author_id)
+    suggestions.mark_changed(instance.user_id)
+    _bump_follow_tags(instance)
+    invalidate_feed_counts(f'follow:{instance.user_id}')
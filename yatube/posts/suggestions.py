@@ -0,0 +1,172 @@
+"""
+Рекомендации «кого почитать».
+
+Кандидаты для пользователя — авторы, которых читают те, кого читает он
+сам (друзья друзей). Оценка — число таких общих подписок, умноженное на
+свежесть последнего поста автора. Граф подписок загружается в память
+одним проходом по таблице Follow в компактные массивы id, а результат —
+не больше ``SUGGESTIONS_PER_USER`` строк на пользователя в
+``FollowSuggestion``, откуда страницы читают их одним запросом по индексу.
+
+Обычный запуск пересчитывает только пользователей из ``SuggestionUpdate``
+(их подписки изменились) и их подписчиков; ``full=True`` — всех, и
+заодно обновляет вклад свежести постов.
+"""
+import heapq
+import itertools
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.caching import bump_tags
+
+from .models import Follow, FollowSuggestion, Post, SuggestionUpdate, User
+
+SUGGESTIONS_TAG = 'suggestions:{}'
+BATCH_SIZE = 500
+
+
+def mark_changed(user_id):
+    """Отмечает, что подписки пользователя изменились."""
+    SuggestionUpdate.objects.bulk_create(
+        [SuggestionUpdate(user_id=user_id)], ignore_conflicts=True)
+
+
+def drop_suggestion(user_id, author_id):
+    """Убирает из рекомендаций автора, на которого уже подписались."""
+    FollowSuggestion.objects.filter(
+        user_id=user_id, author_id=author_id).delete()
+    bump_tags(SUGGESTIONS_TAG.format(user_id))
+
+
+def load_graph():
+    """
+    Подписки и подписчики: словари id → отсортированный array('l').
+
+    Строки читаются потоком в порядке (user, author), поэтому подписки
+    пользователя складываются в массив сразу, без промежуточных списков.
+    """
+    following = {}
+    followers = defaultdict(lambda: array('l'))
+    rows = Follow.objects.order_by('user_id', 'author_id').values_list(
+        'user_id', 'author_id').iterator(chunk_size=10000)
+    for user_id, pairs in itertools.groupby(rows, key=lambda row: row[0]):
+        authors = array('l', (author_id for _, author_id in pairs))
+        following[user_id] = authors
+        for author_id in authors:
+            followers[author_id].append(user_id)
+    return following, dict(followers)
+
+
+def last_posts():
+    return dict(Post.objects.order_by().values_list('author_id').annotate(
+        last=Max('pub_date')))
+
+
+class Builder:
+
+    def __init__(self, full=False, log=None):
+        self.full = full
+        self.log = log or (lambda message: None)
+        self.limit = settings.SUGGESTIONS_PER_USER
+        self.half_life = settings.SUGGESTIONS_HALF_LIFE_DAYS
+        self.now = timezone.now()
+
+    def run(self):
+        """Пересчитывает рекомендации; возвращает число пользователей."""
+        # Отметки, появившиеся во время пересчёта, останутся на следующий.
+        changed = dict(SuggestionUpdate.objects.values_list('pk', 'user_id'))
+        if not changed and not self.full:
+            return 0
+        self.following, self.followers = load_graph()
+        self.activity = {
+            author_id: self.freshness(last)
+            for author_id, last in last_posts().items()
+        }
+        self.popular = self.popular_authors()
+        if self.full:
+            users = list(User.objects.order_by('pk').values_list(
+                'pk', flat=True))
+        else:
+            affected = set(changed.values())
+            for user_id in changed.values():
+                affected.update(self.followers.get(user_id, ()))
+            users = sorted(affected)
+        self.log(f'Пользователей к пересчёту: {len(users)}')
+        for start in range(0, len(users), BATCH_SIZE):
+            self.write(users[start:start + BATCH_SIZE])
+        done = list(changed)
+        for start in range(0, len(done), BATCH_SIZE):
+            SuggestionUpdate.objects.filter(
+                pk__in=done[start:start + BATCH_SIZE]).delete()
+        return len(users)
+
+    def freshness(self, last):
+        """1 для поста «сейчас», вдвое меньше за каждые half_life дней."""
+        days = max((self.now - last).total_seconds() / 86400, 0)
+        return 0.5 ** (days / self.half_life)
+
+    def popular_authors(self):
+        """
+        Запасной список для тех, у кого нет друзей друзей: пары (автор,
+        оценка) по числу подписчиков и свежести постов, с запасом на
+        тех, на кого пользователь уже подписан.
+        """
+        scored = (
+            (author_id,
+             len(followers) * (0.5 + 0.5 * self.activity.get(author_id, 0)))
+            for author_id, followers in self.followers.items()
+        )
+        return heapq.nlargest(
+            self.limit * 2, scored, key=lambda item: (item[1], -item[0]))
+
+    def score(self, mutual, author_id):
+        # Без постов автор всё равно может быть интересен, но ниже.
+        return mutual * (0.5 + 0.5 * self.activity.get(author_id, 0))
+
+    def suggest(self, user_id):
+        """Пары (автор, общих подписок, оценка), лучшие первыми."""
+        followed = self.following.get(user_id, ())
+        skip = set(followed)
+        skip.add(user_id)
+        mutual = defaultdict(int)
+        for author_id in followed:
+            for candidate in self.following.get(author_id, ()):
+                if candidate not in skip:
+                    mutual[candidate] += 1
+        if not mutual:
+            return [
+                (author_id, 0, score)
+                for author_id, score in self.popular if author_id not in skip
+            ][:self.limit]
+        best = heapq.nlargest(
+            self.limit, mutual.items(),
+            key=lambda item: (self.score(item[1], item[0]), -item[0]))
+        return [
+            (author_id, count, self.score(count, author_id))
+            for author_id, count in best
+        ]
+
+    @transaction.atomic
+    def write(self, users):
+        FollowSuggestion.objects.filter(user_id__in=users).delete()
+        FollowSuggestion.objects.bulk_create(
+            FollowSuggestion(
+                user_id=user_id, author_id=author_id,
+                mutual=mutual, score=score)
+            for user_id in users
+            for author_id, mutual, score in self.suggest(user_id)
+        )
+        bump_tags(*(SUGGESTIONS_TAG.format(user_id) for user_id in users))
+
+
+def for_user(user, limit=None):
+    """Рекомендации пользователя: один запрос по индексу (user, score)."""
+    if not user.is_authenticated:
+        return []
+    return list(FollowSuggestion.objects.filter(user=user).select_related(
+        'author').order_by('-score')[:limit or settings.SUGGESTIONS_PER_USER])
@@ -0,0 +1,52 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.thumbnails import get_existing_srcsets
+
+register = template.Library()
+
+CARD_KEY = 'post_card:{}:{}'
+
+
+def card_key(post, srcset):
+    """
+    Ключ карточки: id поста и хеш всего, что в ней показано, кроме
+    текста, — его заменяет updated_at. Правка поста, смена группы или
+    готовность превью дают новый ключ, старая запись просто вытесняется.
+    """
+    version = '|'.join(str(part) for part in (
+        post.updated_at.isoformat(),
+        post.author.username,
+        post.group.slug if post.group_id else '',
+        srcset['srcset'] if srcset else '',
+    ))
+    return CARD_KEY.format(
+        post.pk, hashlib.md5(version.encode()).hexdigest())
+
+
+@register.simple_tag
+def post_cards(posts):
+    """
+    HTML карточек постов страницы по порядку. Карточки одинаковы во всех
+    лентах: готовые берутся из кеша одним get_many, недостающие
+    рисуются и кладутся set_many.
+    """
+    posts = list(posts)
+    srcsets = get_existing_srcsets([post.image for post in posts], 'card')
+    keys = [card_key(post, srcset) for post, srcset in zip(posts, srcsets)]
+    cards = cache.get_many(keys)
+    missing = {}
+    for post, srcset, key in zip(posts, srcsets, keys):
+        if key not in cards:
+            missing[key] = render_to_string(
+                'posts/includes/post_card.html',
+                {'post': post, 'srcset': srcset})
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
@@ -0,0 +1,17 @@
+from django import template
+
+from posts.thumbnails import get_existing_srcset, get_existing_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag
+def existing_thumbnail(image, size='card'):
+    """Готовое превью картинки или None — без обработки во время запроса."""
+    return get_existing_thumbnail(image, size)
+
+
+@register.simple_tag
+def existing_srcset(image, size='card'):
+    """Готовые превью всех ширин для ``<img srcset>`` или None."""
+    return get_existing_srcset(image, size)
@@ -1,6 +1,13 @@
-from django.test import Client, TestCase
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from posts.forms import PostForm
 from posts.models import Post
 
 from .conftest import ConfTests
@@ -48,3 +55,64 @@ class PostCreateFormTests(ConfTests, TestCase):
             id=self.post.id).filter(
                 group=self.group.id).filter(
                     text=self.TEXT_AFTER_EDITING))
+
+
+@override_settings(POST_IMAGE_MAX_SIZE=64, POST_IMAGE_MAX_PIXELS=40000)
+class PostImageFormTests(ConfTests, TestCase):
+
+    def upload(self, size, mode='RGB', image_format='JPEG', name='big.jpg',
+               **save_options):
+        content = BytesIO()
+        Image.new(mode, size).save(content, image_format, **save_options)
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def clean(self, upload):
+        form = PostForm(
+            data={'text': self.NEW_POST}, files={'image': upload})
+        self.assertTrue(form.is_valid(), form.errors)
+        image = form.cleaned_data['image']
+        return image.name, Image.open(image)
+
+    def test_large_photo_is_downscaled_without_metadata(self):
+        """Photos are shrunk to the size cap and lose their EXIF."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        name, image = self.clean(self.upload((180, 120), exif=exif))
+        self.assertEqual(name, 'big.jpg')
+        self.assertEqual(image.size, (64, 43))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertNotIn('exif', image.info)
+
+    def test_format_is_normalized(self):
+        """Opaque PNGs become JPEG; transparent ones stay PNG."""
+        name, image = self.clean(self.upload(
+            (80, 80), image_format='PNG', name='shot.png'))
+        self.assertEqual((name, image.format), ('shot.jpg', 'JPEG'))
+        name, image = self.clean(self.upload(
+            (80, 80), mode='RGBA', image_format='PNG', name='logo.png'))
+        self.assertEqual((name, image.format), ('logo.png', 'PNG'))
+        self.assertEqual(image.mode, 'RGBA')
+
+    def test_decompression_bomb_is_rejected(self):
+        """Images over the pixel limit are rejected before decoding."""
+        form = PostForm(
+            data={'text': self.NEW_POST},
+            files={'image': self.upload((300, 300))})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    @override_settings(POST_IMAGE_KEEP_ORIGINAL=True)
+    def test_original_is_kept_when_configured(self):
+        """With POST_IMAGE_KEEP_ORIGINAL a saved post keeps its upload."""
+        path = os.path.join(
+            settings.MEDIA_ROOT, 'posts', 'originals', 'original.jpg')
+        form = PostForm(data={}, files={
+            'image': self.upload((100, 100), name='original.jpg')})
+        self.assertFalse(form.is_valid())
+        self.assertFalse(os.path.exists(path))
+        form = PostForm(data={'text': self.NEW_POST}, files={
+            'image': self.upload((100, 100), name='original.jpg')})
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save(commit=False)
+        with Image.open(path) as original:
+            self.assertEqual(original.size, (100, 100))
@@ -1,4 +1,23 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import counters, search
+from posts.importing import Importer
+from posts.models import (AuthorStats, Comment, Follow, FollowSuggestion,
+                          Group, ImportCheckpoint, Post, SuggestionUpdate,
+                          TimelineEntry, User)
 
 from .conftest import ConfTests
 
@@ -35,3 +54,397 @@ class PostModelTest(ConfTests, TestCase):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text, expected_value
                 )
+
+
+class QueryPlanTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Follow.objects.create(user=self.name_test1, author=self.user)
+        self.client.force_login(self.name_test1)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feed_queries_use_indexes(self):
+        """No view query falls back to a full scan and a temp B-tree sort."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+        ]
+        for url in urls + [f'{url}?page=1' for url in urls]:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or 'posts_' not in sql:
+                    continue
+                plan = self.explain(sql)
+                with self.subTest(url=url, sql=sql):
+                    for step in plan:
+                        self.assertNotIn('TEMP B-TREE', step, plan)
+                        if step.startswith('SCAN'):
+                            self.assertIn('INDEX', step, plan)
+
+
+class CountersTest(ConfTests, TestCase):
+
+    def stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Stored counters change with posts, follows and comments."""
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).comments_count, 1)
+        post = Post.objects.create(text=self.TEXT_POST, author=self.user)
+        follow = Follow.objects.create(user=self.name_test1, author=self.user)
+        Comment.objects.create(
+            post=post, author=self.name_test1, text=self.NEW_COMMENT)
+        self.assertEqual(self.stats(self.user).posts_count, 2)
+        self.assertEqual(self.stats(self.user).followers_count, 1)
+        self.assertEqual(self.stats(self.name_test1).following_count, 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+        follow.delete()
+        post.delete()
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(self.stats(self.user).followers_count, 0)
+        self.assertEqual(self.stats(self.name_test1).following_count, 0)
+
+    def test_follow_refreshes_follower_profile(self):
+        """The follower's cached profile shows the new following count."""
+        cache.clear()
+        url = reverse('posts:profile', kwargs={'username': self.name_test1})
+        self.assertContains(self.client.get(url), 'Подписок: 0')
+        follow = Follow.objects.create(user=self.name_test1, author=self.user)
+        self.assertContains(self.client.get(url), 'Подписок: 1')
+        follow.delete()
+        self.assertContains(self.client.get(url), 'Подписок: 0')
+
+    def test_post_edit_keeps_concurrent_comment_count(self):
+        """Editing a post does not write back a stale comments_count."""
+        def comment_meanwhile(sender, instance, **kwargs):
+            counters.change_comments_count(instance.pk, 1)
+
+        client = Client()
+        client.force_login(self.user)
+        pre_save.connect(comment_meanwhile, sender=Post)
+        try:
+            client.post(
+                reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+                {'text': self.TEXT_AFTER_EDITING, 'group': self.group.pk})
+        finally:
+            pre_save.disconnect(comment_meanwhile, sender=Post)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.text, self.TEXT_AFTER_EDITING)
+        self.assertEqual(post.comments_count, 2)
+
+    def test_saving_stale_post_keeps_comment_count(self):
+        """Any save of an instance loaded before a comment keeps the count."""
+        post = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(
+            post=post, author=self.name_test1, text=self.NEW_COMMENT)
+        post.text = self.TEXT_AFTER_EDITING
+        post.save()
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.text, self.TEXT_AFTER_EDITING)
+        self.assertEqual(post.comments_count, 2)
+
+    def test_reconcile_counters_fixes_drift(self):
+        """The reconcile command restores drifted and missing counters."""
+        AuthorStats.objects.filter(user=self.user).update(posts_count=7)
+        AuthorStats.objects.filter(user=self.name_test1).delete()
+        Post.objects.filter(pk=self.post.pk).update(comments_count=5)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(self.stats(self.name_test1).posts_count, 0)
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).comments_count, 1)
+
+    def test_group_counters_follow_posts(self):
+        """Group post counts and last activity follow post writes."""
+        other = Group.objects.create(title='Другая', slug='other')
+        first_date = Group.objects.get(pk=self.group.pk).last_post_at
+        self.assertEqual(first_date, self.post.pub_date)
+        post = Post.objects.create(
+            text=self.TEXT_POST, author=self.user, group=self.group)
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(
+            (group.posts_count, group.last_post_at), (2, post.pub_date))
+        post.group = other
+        post.save()
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual((group.posts_count, group.last_post_at),
+                         (1, first_date))
+        other.refresh_from_db()
+        self.assertEqual(
+            (other.posts_count, other.last_post_at), (1, post.pub_date))
+        post.delete()
+        other.refresh_from_db()
+        self.assertEqual((other.posts_count, other.last_post_at), (0, None))
+
+    def test_group_edit_keeps_counters(self):
+        """Saving a group loaded earlier does not roll back its counters."""
+        group = Group.objects.get(pk=self.group.pk)
+        post = Post.objects.create(
+            text=self.TEXT_POST, author=self.user, group=self.group)
+        group.description = 'Новое описание'
+        group.save()
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(group.description, 'Новое описание')
+        self.assertEqual(
+            (group.posts_count, group.last_post_at), (2, post.pub_date))
+
+    def test_reconcile_fixes_group_counters(self):
+        """Reconcile restores drifted group counters."""
+        Group.objects.filter(pk=self.group.pk).update(
+            posts_count=9, last_post_at=None)
+        self.assertEqual(counters.reconcile(), (0, 0, 1))
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(
+            (group.posts_count, group.last_post_at), (1, self.post.pub_date))
+
+    def test_profile_reads_stored_counters(self):
+        """The profile page does not count posts or followers itself."""
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('posts:profile', kwargs={'username': self.user}))
+        self.assertContains(response, 'Всего постов: 1')
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'])
+
+
+class SeedCommandTest(ConfTests, TestCase):
+    SEED_OPTIONS = ['--users', '30', '--groups', '3', '--posts', '200',
+                    '--comments', '300', '--follows', '60']
+
+    def seed(self, *args):
+        call_command('seed_yatube', *self.SEED_OPTIONS, *args,
+                     stdout=StringIO())
+
+    def test_seed_creates_consistent_data(self):
+        """Seeded data has the requested volume, counters and timelines."""
+        posts = Post.objects.count()
+        self.seed()
+        self.assertEqual(Post.objects.count(), posts + 200)
+        self.assertEqual(
+            Follow.objects.filter(
+                user__username__startswith='seed_user_').count(), 60)
+        self.assertEqual(counters.reconcile(), (0, 0, 0))
+        call_command('rebuild_timelines', '--check', stdout=StringIO())
+        dates = list(Post.objects.order_by('pk').values_list(
+            'pub_date', flat=True))
+        self.assertEqual(dates[1:], sorted(dates[1:]))
+
+    def test_seed_adds_only_seeded_rows_to_derived_tables(self):
+        """Timelines and the search index are extended, not rebuilt."""
+        with CaptureQueriesContext(connection) as queries:
+            self.seed()
+        for query in queries.captured_queries:
+            self.assertNotIn('DELETE FROM', query['sql'])
+        seeded = Post.objects.filter(
+            author__username__startswith='seed_user_').latest('pk')
+        word = seeded.text.split()[0]
+        self.assertIn(
+            seeded, search.filter_posts(Post.objects.all(), word))
+        self.assertIn(
+            self.post, search.filter_posts(Post.objects.all(), self.post.text))
+
+    def test_seed_is_reproducible(self):
+        """The same seed gives the same posts."""
+        def seeded_posts():
+            return list(Post.objects.filter(
+                author__username__startswith='seed_user_',
+            ).order_by('pk').values_list('text', flat=True))
+
+        self.seed('--seed', '7')
+        first = seeded_posts()
+        Post.objects.filter(
+            author__username__startswith='seed_user_').delete()
+        User.objects.filter(username__startswith='seed_user_').delete()
+        self.seed('--seed', '7')
+        self.assertEqual(seeded_posts(), first)
+
+
+class ImportCommandTest(ConfTests, TestCase):
+    RECORDS = [
+        {'type': 'post', 'id': 1001, 'author': 'leo', 'group': 'cats',
+         'text': 'Первый пост', 'pub_date': '2022-12-01T10:00:00+00:00'},
+        {'type': 'post', 'id': 1002, 'author': 'leo',
+         'text': 'Второй пост', 'pub_date': '2022-12-02T10:00:00'},
+        {'type': 'comment', 'post': 1001, 'author': 'auth',
+         'text': 'Комментарий', 'created': '2022-12-01T11:00:00+00:00'},
+        {'type': 'comment', 'post': 99999, 'author': 'auth', 'text': 'x'},
+        {'type': 'follow', 'user': 'auth', 'author': 'leo'},
+        {'type': 'post', 'author': 'leo', 'text': ''},
+    ]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'dump.jsonl')
+        with open(self.path, 'w', encoding='utf-8') as dump:
+            for record in self.RECORDS:
+                dump.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def run_import(self, *args):
+        call_command('import_yatube', self.path, '--batch-size', '2', *args,
+                     stdout=StringIO())
+
+    def test_import_creates_rows_and_derived_data(self):
+        """Imported rows keep ids and dates; counters and feeds follow."""
+        self.run_import()
+        post = Post.objects.get(pk=1001)
+        self.assertEqual(post.author.username, 'leo')
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.pub_date.day, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(post.comments.get().created.hour, 11)
+        self.assertEqual(Post.objects.filter(author=post.author).count(), 2)
+        self.assertEqual(AuthorStats.objects.get(
+            user=post.author).followers_count, 1)
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.user, post__author=post.author).count(), 2)
+        self.assertEqual(
+            ImportCheckpoint.objects.get().position, len(self.RECORDS))
+
+    def test_import_keeps_derived_data_consistent(self):
+        """Counters, search and ids match a full reconcile after import."""
+        with open(self.path, 'a', encoding='utf-8') as dump:
+            dump.write(json.dumps({
+                'type': 'post', 'author': 'leo', 'group': 'cats',
+                'text': 'Пост без id'}, ensure_ascii=False) + '\n')
+        self.run_import()
+        post = Post.objects.get(text='Пост без id')
+        self.assertGreater(post.pk, 1002)
+        self.assertEqual(post.group.posts_count, 2)
+        self.assertEqual(post.group.last_post_at, post.pub_date)
+        self.assertEqual(counters.reconcile(), (0, 0, 0))
+        self.assertEqual(
+            list(search.filter_posts(Post.objects.all(), 'без id')), [post])
+
+    def test_import_invalidates_only_affected_caches(self):
+        """Imported posts reach cached pages; unrelated cache entries stay."""
+        cache.clear()
+        cache.set('unrelated', 1)
+        profile = reverse('posts:profile', kwargs={'username': self.user})
+        self.assertContains(self.client.get(profile), 'Подписок: 0')
+        self.client.get(reverse('posts:index'))
+        self.run_import()
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'Второй пост')
+        self.assertContains(self.client.get(profile), 'Подписок: 1')
+        self.assertEqual(cache.get('unrelated'), 1)
+
+    def test_each_batch_invalidates_its_pages(self):
+        """A committed batch reaches cached pages even if a later one fails."""
+        User.objects.create_user('leo')
+        Group.objects.create(title='cats', slug='cats')
+        index = reverse('posts:index')
+        self.client.get(index)
+        write = Importer.write
+
+        def fail_after_first_batch(importer, batch, position):
+            if position:
+                raise RuntimeError('stop')
+            write(importer, batch, position)
+
+        with mock.patch.object(Importer, 'write', fail_after_first_batch):
+            with self.assertRaises(RuntimeError):
+                self.run_import()
+        self.assertContains(self.client.get(index), 'Второй пост')
+
+    def test_overlapping_ids_are_skipped(self):
+        """Posts whose id is taken are counted as skipped, not fatal."""
+        Post.objects.create(pk=1001, author=self.user, text='Свой пост')
+        with open(self.path, 'a', encoding='utf-8') as dump:
+            dump.write(json.dumps({
+                'type': 'post', 'id': 1002, 'author': 'leo',
+                'text': 'Повтор'}, ensure_ascii=False) + '\n')
+        out = StringIO()
+        call_command('import_yatube', self.path, stdout=out)
+        self.assertEqual(Post.objects.get(pk=1001).text, 'Свой пост')
+        self.assertEqual(Post.objects.get(pk=1002).text, 'Второй пост')
+        self.assertIn('Пост 1001 пропущен', out.getvalue())
+        self.assertIn('пропущено: 4', out.getvalue())
+        self.assertEqual(counters.reconcile(), (0, 0, 0))
+
+    def test_import_resumes_from_checkpoint(self):
+        """A second run starts after the last committed batch."""
+        ImportCheckpoint.objects.create(
+            source=os.path.abspath(self.path), position=2)
+        self.run_import()
+        self.assertFalse(Post.objects.filter(pk__in=[1001, 1002]).exists())
+        self.assertTrue(Follow.objects.filter(
+            user=self.user, author__username='leo').exists())
+        self.run_import()
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+
+    def test_csv_import(self):
+        """CSV files are read with the record type given on the command."""
+        path = self.path.replace('.jsonl', '.csv')
+        with open(path, 'w', encoding='utf-8') as dump:
+            dump.write('user,author\nauth,test1\ntest2,test1\n')
+        call_command('import_yatube', path, '--type', 'follow',
+                     stdout=StringIO())
+        self.assertEqual(
+            Follow.objects.filter(author=self.name_test1).count(), 2)
+
+
+class SuggestionsTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.test3 = User.objects.create_user(username='test3')
+        Follow.objects.create(user=self.user, author=self.name_test1)
+        Follow.objects.create(user=self.name_test1, author=self.name_test2)
+        Follow.objects.create(user=self.name_test2, author=self.test3)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def build(self, *args):
+        out = StringIO()
+        call_command('build_suggestions', *args, stdout=out)
+        return out.getvalue()
+
+    def suggested(self, user):
+        return list(FollowSuggestion.objects.filter(user=user).values_list(
+            'author__username', 'mutual'))
+
+    def test_friends_of_friends_are_suggested(self):
+        """Authors read by followed authors are suggested and shown."""
+        self.build()
+        self.assertEqual(self.suggested(self.user), [('test2', 1)])
+        self.assertFalse(SuggestionUpdate.objects.exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [item.author for item in response.context['suggestions']],
+            [self.name_test2])
+        response = self.authorized_client.get(
+            reverse('posts:profile', kwargs={'username': self.user}))
+        self.assertContains(response, 'Кого почитать')
+        Follow.objects.create(user=self.user, author=self.name_test2)
+        self.assertEqual(self.suggested(self.user), [])
+
+    def test_run_is_incremental(self):
+        """Only users whose follows changed and their followers rerun."""
+        self.build()
+        self.assertIn('пользователей: 0', self.build())
+        Follow.objects.create(user=self.name_test1, author=self.test3)
+        self.assertIn('пользователей: 2', self.build())
+        self.assertCountEqual(
+            self.suggested(self.user), [('test2', 1), ('test3', 1)])
+
+    def test_users_without_follows_get_popular_authors(self):
+        """Users following nobody are offered the most followed authors."""
+        Follow.objects.create(user=self.name_test2, author=self.name_test1)
+        self.build('--full')
+        self.assertEqual(
+            [author for author, _ in self.suggested(self.test3)],
+            ['test1', 'test2'])
@@ -45,6 +45,7 @@ class PostsURLTests(ConfTests, TestCase):
         """The URL uses the appropriate pattern."""
         templates_url_names = {
             '/': 'posts/index.html',
+            '/groups/': 'posts/group_index.html',
             f'/group/{self.group.slug}/': 'posts/group_list.html',
             f'/profile/{self.user}/': 'posts/profile.html',
             f'/posts/{self.post.pk}/': 'posts/post_detail.html',
@@ -1,10 +1,29 @@
+import json
+import time
+import uuid
+import zipfile
+from io import BytesIO, StringIO
+
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template import Context, Template
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
+from PIL import Image
 
-from posts.models import Comment, Follow, Post, User
+from core import jobs
+from core.models import Job
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+from posts.thumbnails import (generate_thumbnails, get_existing_srcset,
+                              get_existing_thumbnail)
+from posts.utils import CachedCountPaginator
 
 from .conftest import ConfTests
 
@@ -128,16 +147,40 @@ class PostsPagesTests(ConfTests, TestCase):
     def test_cache_on_index_page(self):
         response = self.authorized_client.get(reverse('posts:index'))
         before_content = response.content
-        Post.objects.all().delete()
-        response_after_removal = self.authorized_client.get(
+        # Изменение в обход модели не сбрасывает кеш.
+        Post.objects.update(text=self.TEXT_AFTER_EDITING)
+        response_after_update = self.authorized_client.get(
             reverse('posts:index'))
-        after_removal_obj = response_after_removal.content
-        self.assertEqual(before_content, after_removal_obj)
+        self.assertEqual(before_content, response_after_update.content)
         cache.clear()
         response = self.authorized_client.get(reverse('posts:index'))
         after_deleting_cache = response.content
         self.assertNotEqual(before_content, after_deleting_cache)
 
+    def test_cache_is_invalidated_by_writes(self):
+        """Cached feeds and post pages are refreshed right after a write."""
+        post = Post.objects.get(pk=self.list_post[-1].pk)
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        ]
+        for url in urls:
+            self.authorized_client.get(url)
+        post.text = self.TEXT_AFTER_EDITING
+        post.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, self.TEXT_AFTER_EDITING)
+        self.authorized_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            data={'text': self.NEW_COMMENT}
+        )
+        response = self.authorized_client.get(urls[-1])
+        self.assertContains(response, self.NEW_COMMENT)
+
 
 class PaginatorViewsTest(ConfTests, TestCase):
 
@@ -270,3 +313,742 @@ class FollowTest(ConfTests, TestCase):
         )
         self.assertEqual(
             response_not_signed.content, response_before_not_signed.content)
+
+
+class CursorPaginatorTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for _ in range(self.COUNT_POST * 2):
+            Post.objects.create(
+                text=self.TEXT_POST,
+                author=self.user,
+                group=self.group,
+            )
+
+    def test_cursor_walks_whole_feed_without_count_and_offset(self):
+        """Cursor pages cover the feed once, without COUNT or OFFSET."""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        seen = []
+        cursor = ''
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                response = self.client.get(url + f'?cursor={cursor}')
+                page_obj = response.context['page_obj']
+                seen.extend(post.id for post in page_obj)
+                if not page_obj.has_next():
+                    break
+                cursor = page_obj.paginator.next_cursor
+        self.assertEqual(
+            seen, list(self.group.posts.values_list('id', flat=True)))
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'])
+            self.assertNotIn('OFFSET', query['sql'])
+
+    def test_previous_cursor_returns_previous_page(self):
+        """Going back with previous_cursor shows the page seen before."""
+        url = reverse('posts:index')
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(
+            url + f'?cursor={first.paginator.next_cursor}'
+        ).context['page_obj']
+        third = self.client.get(
+            url + f'?cursor={second.paginator.next_cursor}'
+        ).context['page_obj']
+        back = self.client.get(
+            url + f'?cursor={third.paginator.previous_cursor}'
+        ).context['page_obj']
+        self.assertEqual(list(back), list(second))
+        self.assertTrue(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        """An invalid cursor shows the first page instead of an error."""
+        response = self.client.get(reverse('posts:index') + '?cursor=xyz')
+        self.assertEqual(
+            list(response.context['page_obj']),
+            list(Post.objects.all()[:settings.AMOUNT_OF_POSTS_TO_DISPLAY]))
+
+
+class CachedCountPaginatorTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for _ in range(self.COUNT_POST):
+            Post.objects.create(
+                text=self.TEXT_POST,
+                author=self.user,
+                group=self.group,
+            )
+        self.url = reverse(
+            'posts:group_list', kwargs={'slug': self.group.slug}) + '?page=2'
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        return response, [
+            query['sql'] for query in queries.captured_queries
+            if 'COUNT(' in query['sql'] and 'posts_post' in query['sql']
+        ]
+
+    def test_feed_count_is_cached(self):
+        """The feed COUNT(*) runs once and is then read from the cache."""
+        _, first = self.count_queries()
+        _, second = self.count_queries()
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+
+    def test_feed_count_refreshed_on_post_write(self):
+        """Creating and deleting a post refreshes the cached count."""
+        response, _ = self.count_queries()
+        count = response.context['page_obj'].paginator.count
+        post = Post.objects.create(
+            text=self.TEXT_POST, author=self.user, group=self.group)
+        response, _ = self.count_queries()
+        self.assertEqual(
+            response.context['page_obj'].paginator.count, count + 1)
+        post.delete()
+        response, _ = self.count_queries()
+        self.assertEqual(response.context['page_obj'].paginator.count, count)
+
+    def test_elided_page_range_is_bounded(self):
+        """The page window has the same length however many pages exist."""
+        for pages in (100, 10000):
+            paginator = CachedCountPaginator(range(pages), 1)
+            page_range = list(paginator.get_elided_page_range(pages // 2))
+            self.assertEqual(len(page_range), 9)
+            self.assertEqual(page_range[0], 1)
+            self.assertEqual(page_range[-1], pages)
+            self.assertIn(pages // 2, page_range)
+
+
+class GroupIndexTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Group.objects.bulk_create([
+            Group(title=f'Группа {number:03}', slug=f'group-{number}')
+            for number in range(settings.GROUPS_PER_PAGE + 5)
+        ])
+        self.url = reverse('posts:group_index')
+
+    def test_group_index_shows_stored_counters(self):
+        """The directory lists groups with post counts and last activity."""
+        Post.objects.create(
+            text=self.TEXT_POST, author=self.user, group=self.group)
+        response = self.client.get(self.url)
+        group = response.context['page_obj'].object_list[0]
+        self.assertEqual(group, self.group)
+        self.assertEqual(group.posts_count, 2)
+        self.assertContains(
+            response, reverse('posts:group_list', args=[self.group.slug]))
+
+    def test_group_index_does_not_read_posts(self):
+        """A directory page is one query for groups, cached afterwards."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(
+            len(response.context['page_obj']), settings.GROUPS_PER_PAGE)
+        for query in queries.captured_queries:
+            self.assertNotIn('posts_post', query['sql'])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(any(
+            'posts_group' in query['sql']
+            for query in queries.captured_queries))
+
+    def test_group_index_refreshed_on_post_write(self):
+        """A new post shows up in the cached directory."""
+        self.client.get(self.url)
+        Post.objects.create(
+            text=self.TEXT_POST, author=self.user, group=self.group)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.context['page_obj'].object_list[0].posts_count, 2)
+
+
+class TimelineTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.follower = Client()
+        self.follower.force_login(self.name_test1)
+        self.author = Client()
+        self.author.force_login(self.user)
+
+    def follow_feed(self):
+        response = self.follower.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_timeline_follows_subscriptions(self):
+        """Follow backfills, new posts fan out and unfollow prunes."""
+        self.assertEqual(self.follow_feed(), [])
+        self.follower.get(
+            reverse('posts:profile_follow', kwargs={'username': self.user}))
+        self.assertEqual(self.follow_feed(), [self.post])
+        self.author.post(
+            reverse('posts:post_create'), data={'text': self.NEW_POST})
+        new_post = Post.objects.get(text=self.NEW_POST)
+        self.assertEqual(self.follow_feed(), [new_post, self.post])
+        self.follower.get(
+            reverse('posts:profile_unfollow', kwargs={'username': self.user}))
+        self.assertEqual(self.follow_feed(), [])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_rebuild_timelines_command(self):
+        """The command reports drift and rebuilds the timelines."""
+        Follow.objects.create(user=self.name_test1, author=self.user)
+        call_command('rebuild_timelines', '--check', stdout=StringIO())
+        TimelineEntry.objects.all().delete()
+        TimelineEntry.objects.create(
+            user=self.name_test2, post=self.post, pub_date=self.post.pub_date)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_timelines', '--check', stdout=StringIO())
+        call_command('rebuild_timelines', stdout=StringIO())
+        call_command('rebuild_timelines', '--check', stdout=StringIO())
+        self.assertEqual(self.follow_feed(), [self.post])
+
+
+class PostDetailCommentsTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+
+    def add_comments(self, count):
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.name_test1, text=str(i))
+            for i in range(count))
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        return len(queries.captured_queries)
+
+    def test_post_detail_query_count_is_constant(self):
+        """post_detail runs as many queries for 1 comment as for 100."""
+        few = self.count_queries()
+        self.add_comments(settings.COMMENTS_PER_PAGE * 5)
+        self.assertEqual(self.count_queries(), few)
+
+    def test_comments_are_paginated_with_load_more(self):
+        """Only one page of comments is rendered; the rest loads by cursor."""
+        self.add_comments(settings.COMMENTS_PER_PAGE)
+        response = self.client.get(self.url)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), settings.COMMENTS_PER_PAGE)
+        self.assertTrue(comments.has_next())
+        fragment = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            {'comments': comments.paginator.next_cursor},
+        )
+        self.assertTemplateUsed(fragment, 'posts/includes/comments.html')
+        self.assertEqual(
+            [comment.text for comment in fragment.context['comments']],
+            [str(settings.COMMENTS_PER_PAGE - 1)])
+
+
+class ThumbnailTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.post_with_image = Post.objects.create(
+            text=self.TEXT_POST,
+            author=self.user,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            ),
+        )
+        self.url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post_with_image.pk})
+
+    def test_missing_thumbnail_is_not_generated_in_request(self):
+        """Without a ready thumbnail the page shows a placeholder."""
+        response = self.client.get(self.url)
+        self.assertNotContains(response, '<img class="card-img')
+        self.assertContains(response, 'bg-light')
+        self.assertIsNone(
+            get_existing_thumbnail(self.post_with_image.image, 'card'))
+
+    def test_upload_queues_thumbnails_for_workers(self):
+        """A new image queues one thumbnail job that a worker completes."""
+        name = self.post_with_image.image.name
+        self.post_with_image.save()
+        self.assertEqual(
+            Job.objects.filter(dedup_key=f'thumbnails:{name}').count(), 1)
+        jobs.run_pending()
+        self.assertIsNotNone(
+            get_existing_thumbnail(self.post_with_image.image, 'card'))
+
+    def test_finished_job_refreshes_cached_pages(self):
+        """Pages cached with a placeholder show the srcset once it is ready."""
+        post = Post.objects.create(
+            text=self.TEXT_POST, author=self.user, group=self.group,
+            image=SimpleUploadedFile(
+                f'{uuid.uuid4().hex}.gif', self.small_gif))
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        ]
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            self.assertNotContains(response, 'srcset=')
+            etags[url] = response.get('ETag')
+        jobs.run_pending()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url] or '')
+                self.assertContains(response, 'srcset=')
+
+    def test_pregenerated_thumbnail_is_used(self):
+        """Thumbnails made by the worker are picked up by the templates."""
+        generate_thumbnails(self.post_with_image.image.name)
+        thumbnail = get_existing_thumbnail(self.post_with_image.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(self.url)
+        self.assertContains(response, thumbnail.url)
+
+    def test_thumbnails_follow_media_root(self):
+        """Thumbnails are written under the current MEDIA_ROOT."""
+        generate_thumbnails(self.post_with_image.image.name)
+        thumbnail = get_existing_thumbnail(self.post_with_image.image, 'card')
+        self.assertTrue(thumbnail.storage.path(thumbnail.name).startswith(
+            settings.MEDIA_ROOT))
+
+    def test_srcset_lists_widths_up_to_the_source(self):
+        """Feeds get every ready width, none wider than the original."""
+        content = BytesIO()
+        Image.new('RGB', (1000, 400)).save(content, 'JPEG')
+        post = Post.objects.create(
+            text=self.TEXT_POST,
+            author=self.user,
+            image=SimpleUploadedFile('wide.jpg', content.getvalue()),
+        )
+        call_command('generate_thumbnails', stdout=StringIO())
+        srcset = get_existing_srcset(post.image, 'card')
+        self.assertEqual(
+            [item.split()[-1] for item in srcset['srcset'].split(', ')],
+            ['320w', '480w', '720w', '960w'])
+        self.assertEqual(
+            srcset['src'], get_existing_thumbnail(post.image, 'card').url)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'srcset="{srcset["srcset"]}"')
+        self.assertContains(response, 'loading="lazy"')
+
+
+class SearchTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.django_post = Post.objects.create(
+            text='Кеширование страниц в Django', author=self.user)
+        self.often_post = Post.objects.create(
+            text='Django, django и снова django', author=self.name_test1)
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params})
+        return [post.pk for post in response.context['page_obj']]
+
+    def test_search_is_ranked(self):
+        """Posts matching the query better come first."""
+        self.assertEqual(
+            self.search('django'), [self.often_post.pk, self.django_post.pk])
+        self.assertEqual(self.search('страниц кеш'), [self.django_post.pk])
+        self.assertEqual(self.search('джанго'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Edited and deleted posts are reindexed right away."""
+        self.django_post.text = 'Про котов'
+        self.django_post.save()
+        self.assertEqual(self.search('django'), [self.often_post.pk])
+        self.assertEqual(self.search('кото'), [self.django_post.pk])
+        self.often_post.delete()
+        self.assertEqual(self.search('django'), [])
+
+    def test_pages_keep_the_query(self):
+        """Paginator links carry the search query."""
+        for number in range(settings.AMOUNT_OF_POSTS_TO_DISPLAY):
+            Post.objects.create(text=f'django {number}', author=self.user)
+        response = self.client.get(reverse('posts:search'), {'q': 'django'})
+        self.assertContains(response, '?q=django&amp;page=2')
+        self.assertEqual(len(self.search('django', page=2)), 2)
+
+    def test_admin_and_rebuild_use_the_index(self):
+        """Admin search reads the index; the command rebuilds it."""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        Post.objects.filter(pk=self.django_post.pk).update(text='Про котов')
+        url = reverse('admin:posts_post_changelist')
+        response = self.client.get(url, {'q': 'котов'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.client.get(url, {'q': 'котов'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.django_post])
+
+
+class ExportTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.url = reverse(
+            'posts:profile_export', kwargs={'username': self.user.username})
+        Post.objects.create(
+            text=self.NEW_POST,
+            author=self.user,
+            image=SimpleUploadedFile(
+                name='export.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            ),
+        )
+        Follow.objects.create(user=self.user, author=self.name_test1)
+
+    def test_export_is_streamed_as_zip(self):
+        """The archive holds all records and the post images."""
+        response = self.authorized_client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(
+            BytesIO(b''.join(response.streaming_content)))
+        records = [
+            json.loads(line)
+            for line in archive.read('data.jsonl').decode().splitlines()
+        ]
+        self.assertEqual(
+            [record['type'] for record in records],
+            ['post', 'post', 'comment', 'follow'])
+        self.assertEqual(records[-1]['author'], self.name_test1.username)
+        image = records[1]['image']
+        self.assertEqual(archive.read(f'images/{image}'), self.small_gif)
+
+    def test_export_as_jsonl(self):
+        """?format=jsonl streams the records without images."""
+        response = self.authorized_client.get(self.url, {'format': 'jsonl'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[0])['text'], self.TEXT_POST)
+
+    def test_export_is_private(self):
+        """Only the owner can download the archive."""
+        self.assertRedirects(
+            self.client.get(self.url),
+            f'{reverse("users:login")}?next={self.url}')
+        other = Client()
+        other.force_login(self.name_test1)
+        self.assertEqual(other.get(self.url).status_code, 404)
+        response = self.authorized_client.get(
+            reverse('posts:profile', kwargs={'username': self.user}))
+        self.assertContains(response, self.url)
+
+
+class ApiTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for number in range(settings.AMOUNT_OF_POSTS_TO_DISPLAY):
+            Post.objects.create(
+                text=f'api {number}', author=self.user, group=self.group)
+        self.url = reverse('posts:api_index')
+
+    def test_feed_is_paginated_by_cursor(self):
+        """The JSON feed walks all posts with next links."""
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['text'], 'api 9')
+        self.assertIsNone(data['previous'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(
+            [post['id'] for post in data['results']], [self.post.pk])
+        self.assertIsNone(data['next'])
+
+    def test_fields_selection(self):
+        """?fields= limits the keys; unknown fields are rejected."""
+        response = self.client.get(self.url, {'fields': 'id,author'})
+        self.assertEqual(
+            set(response.json()['results'][0]), {'id', 'author'})
+        response = self.client.get(self.url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_group_profile_and_post(self):
+        """Group, profile and post endpoints mirror the HTML pages."""
+        data = self.client.get(reverse(
+            'posts:api_group_posts', kwargs={'slug': self.SLUG_GROUP})).json()
+        self.assertEqual(data['group']['title'], self.TITLE_GROUP)
+        self.assertEqual(len(data['results']), 10)
+        data = self.client.get(reverse(
+            'posts:api_profile', kwargs={'username': self.user})).json()
+        self.assertEqual(data['author']['posts_count'], 11)
+        data = self.client.get(reverse(
+            'posts:api_post', kwargs={'post_id': self.post.pk})).json()
+        self.assertEqual(data['comments_count'], 1)
+        self.assertEqual(data['comments'][0]['text'], self.COMMENT)
+        response = self.client.get(reverse(
+            'posts:api_group_posts', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_modified(self):
+        """Unchanged feeds answer 304 without reading the posts."""
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(len(queries), 1)
+        post = Post.objects.latest('pub_date')
+        post.text = 'edited'
+        post.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since_after_edit_and_comment(self):
+        """Edited posts and new comments are sent, not a stale 304."""
+        since = http_date(time.time() + 60)
+        post = Post.objects.filter(author=self.user).latest('pub_date')
+        post_url = reverse('posts:api_post', kwargs={'post_id': post.pk})
+        profile_url = reverse(
+            'posts:api_profile', kwargs={'username': self.user})
+        for url in (post_url, profile_url):
+            self.assertNotIn('Last-Modified', self.client.get(url))
+        post.text = 'edited'
+        post.save()
+        for url in (post_url, profile_url):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'edited')
+        Comment.objects.create(post=post, author=self.user, text='new')
+        response = self.client.get(post_url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.json()['comments'][-1]['text'], 'new')
+
+    def test_new_comment_changes_post_etag(self):
+        """A new comment makes the post's old ETag stale."""
+        url = reverse('posts:api_post', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(post=self.post, author=self.user, text='new')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['comments']), 2)
+
+
+class ConditionalViewsTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.name_test1)
+        self.pages = {
+            'group': reverse(
+                'posts:group_list', kwargs={'slug': self.SLUG_GROUP}),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': self.user}),
+            'post': reverse(
+                'posts:post_detail', kwargs={'post_id': self.post.pk}),
+        }
+
+    def assertNotModified(self, client, url):
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unchanged_pages_answer_304(self):
+        """A repeated request with the page's ETag is not rendered."""
+        for name, url in self.pages.items():
+            with self.subTest(page=name):
+                self.assertNotModified(Client(), url)
+                self.assertNotModified(self.authorized_client, url)
+        Follow.objects.create(user=self.name_test1, author=self.user)
+        self.assertNotModified(
+            self.authorized_client, reverse('posts:follow_index'))
+
+    def test_etag_depends_on_viewer(self):
+        """Login, follow state and edit rights change the ETag."""
+        for name, url in self.pages.items():
+            with self.subTest(page=name):
+                anonymous = self.client.get(url)['ETag']
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=anonymous)
+                self.assertEqual(response.status_code, 200)
+        url = self.pages['profile']
+        etag = self.authorized_client.get(url)['ETag']
+        Follow.objects.create(user=self.name_test1, author=self.user)
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Отписаться')
+        author = Client()
+        author.force_login(self.user)
+        url = self.pages['post']
+        etag = self.authorized_client.get(url)['ETag']
+        self.assertNotEqual(author.get(url)['ETag'], etag)
+
+    def test_etag_and_body_describe_same_viewer(self):
+        """A page cached for one viewer is not sent under another's ETag."""
+        author = Client()
+        author.force_login(self.user)
+        for name, url in self.pages.items():
+            with self.subTest(page=name):
+                author.get(url)
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'Выйти')
+                self.assertNotContains(response, 'редактировать запись')
+                response = self.client.get(url)
+                self.assertContains(response, 'Войти')
+        url = self.pages['profile']
+        self.assertContains(self.authorized_client.get(url), 'Подписаться')
+        Follow.objects.create(user=self.name_test1, author=self.user)
+        etag = self.authorized_client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Отписаться')
+
+    def test_writes_change_etag(self):
+        """New comments and edited posts are shown, not 304."""
+        url = self.pages['post']
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.user, text=self.NEW_COMMENT)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, self.NEW_COMMENT)
+        url = self.pages['group']
+        etag = self.client.get(url)['ETag']
+        self.post.text = self.TEXT_AFTER_EDITING
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, self.TEXT_AFTER_EDITING)
+
+    def test_if_modified_since_never_gives_stale_304(self):
+        """Edits and comments keep pub_date, so pages carry no dates."""
+        since = http_date(time.time() + 60)
+        for url in self.pages.values():
+            self.assertNotIn('Last-Modified', self.client.get(url))
+        self.post.text = self.TEXT_AFTER_EDITING
+        self.post.save()
+        Comment.objects.create(
+            post=self.post, author=self.user, text=self.NEW_COMMENT)
+        for name, url in self.pages.items():
+            with self.subTest(page=name):
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=since)
+                self.assertContains(response, self.TEXT_AFTER_EDITING)
+        response = self.client.get(
+            self.pages['post'], HTTP_IF_MODIFIED_SINCE=since)
+        self.assertContains(response, self.NEW_COMMENT)
+
+
+class PerViewerCacheTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.post_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+
+    def login(self, user, **kwargs):
+        client = Client(**kwargs)
+        client.force_login(user)
+        return client
+
+    def test_cached_pages_are_not_shared_between_viewers(self):
+        """One viewer's header and buttons never reach another viewer."""
+        author = self.login(self.user)
+        self.assertContains(author.get(self.post_url), 'редактировать')
+        other = self.login(self.name_test1)
+        self.assertNotContains(other.get(self.post_url), 'редактировать')
+        self.assertNotContains(self.client.get(self.post_url), 'редактировать')
+        index = reverse('posts:index')
+        self.assertContains(self.client.get(index), 'Войти')
+        self.assertContains(other.get(index), 'Выйти')
+
+    def test_cached_form_has_viewer_csrf_token(self):
+        """A comment form from the page cache passes the CSRF check."""
+        self.login(self.name_test2, enforce_csrf_checks=True).get(
+            self.post_url)
+        client = self.login(self.name_test1, enforce_csrf_checks=True)
+        for _ in range(2):
+            response = client.get(self.post_url)
+            response = client.post(
+                reverse('posts:add_comment', args=[self.post.pk]),
+                {'text': self.NEW_COMMENT,
+                 'csrfmiddlewaretoken': self.token(response)})
+            self.assertEqual(response.status_code, 302)
+
+    @staticmethod
+    def token(response):
+        content = response.content.decode()
+        start = content.index('name="csrfmiddlewaretoken" value="') + 34
+        return content[start:content.index('"', start)]
+
+    def test_browsers_revalidate_cached_pages(self):
+        """Pages are cached on the server, not for minutes in the browser."""
+        response = self.client.get(reverse('posts:index'))
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        self.assertFalse(response.has_header('Expires'))
+
+
+class PostCardTest(ConfTests, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.group_url = reverse(
+            'posts:group_list', kwargs={'slug': self.SLUG_GROUP})
+
+    def card_templates(self, url):
+        response = self.client.get(url)
+        return [
+            template.name for template in response.templates
+            if template.name == 'posts/includes/post_card.html'
+        ]
+
+    def test_cards_are_shared_between_feeds(self):
+        """A card rendered for one feed is reused by the others."""
+        self.assertEqual(len(self.card_templates(reverse('posts:index'))), 1)
+        self.assertEqual(self.card_templates(self.group_url), [])
+        self.assertEqual(self.card_templates(reverse(
+            'posts:profile', kwargs={'username': self.user})), [])
+
+    def test_edit_renders_a_new_card(self):
+        """post_edit moves updated_at, so the stale card is not used."""
+        self.client.get(self.group_url)
+        updated_at = self.post.updated_at
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+            data={'text': self.TEXT_AFTER_EDITING, 'group': self.group.pk})
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.updated_at, updated_at)
+        response = self.client.get(self.group_url)
+        self.assertContains(response, self.TEXT_AFTER_EDITING)
+
+    def test_ready_thumbnail_renders_a_new_card(self):
+        """The placeholder card is replaced once thumbnails exist."""
+        post = Post.objects.create(
+            text=self.NEW_POST,
+            author=self.user,
+            # Временный MEDIA_ROOT общий для классов: имя не повторяется.
+            image=SimpleUploadedFile(
+                f'{uuid.uuid4().hex}.gif', self.small_gif),
+        )
+        template = Template(
+            '{% load post_cards %}{% post_cards posts as cards %}'
+            '{% for card in cards %}{{ card }}{% endfor %}')
+        context = Context({'posts': [post]})
+        self.assertIn('bg-light', template.render(context))
+        generate_thumbnails(post.image.name)
+        self.assertIn(
+            get_existing_thumbnail(post.image, 'card').url,
+            template.render(context))
@@ -0,0 +1,244 @@
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.functional import cached_property
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import jobs
+from core.caching import bump_tags
+
+from .models import Post
+
+READY_KEY = 'thumbnail_ready:{}'
+
+
+class ThumbnailStorage(FileSystemStorage):
+    """
+    Отдельный каталог для превью (THUMBNAIL_ROOT): воркеры очереди пишут
+    только сюда и не трогают каталог загруженных картинок.
+
+    Без THUMBNAIL_ROOT это подкаталог thumbnails текущего MEDIA_ROOT: он
+    вычисляется при первом обращении и сбрасывается при смене настроек.
+    """
+
+    def __init__(self):
+        super().__init__(base_url=settings.THUMBNAIL_URL)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting in ('MEDIA_ROOT', 'THUMBNAIL_ROOT'):
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+    @cached_property
+    def base_location(self):
+        return settings.THUMBNAIL_ROOT or os.path.join(
+            settings.MEDIA_ROOT, 'thumbnails')
+
+
+class PregeneratedThumbnailBackend(ThumbnailBackend):
+    """
+    Бэкенд sorl-thumbnail с раздельными созданием и поиском превью.
+
+    Шаблоны не должны декодировать картинки во время запроса: превью
+    создаются заранее воркерами очереди задач (``schedule_thumbnails``),
+    а ``get_existing_thumbnail`` только проверяет, что файл уже есть.
+    Готовность отмечается в кеше, а не в key-value хранилище sorl, так
+    что создание превью не пишет в базу данных.
+    """
+
+    def _source(self, file_):
+        # Имя без хранилища — картинка поста из MEDIA_ROOT, а не превью.
+        if isinstance(file_, str):
+            return ImageFile(file_, default_storage)
+        return ImageFile(file_)
+
+    def _thumbnail_file(self, file_, geometry_string, options):
+        # Те же значения по умолчанию, что и в ThumbnailBackend.get_thumbnail,
+        # иначе имя файла превью не совпадёт.
+        source = self._source(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def create_thumbnail(self, file_, geometry_string, **options):
+        """
+        Создаёт файл превью, если его ещё нет, и отмечает готовность.
+        Возвращает пару (превью, создано ли оно сейчас).
+        """
+        thumbnail = self._thumbnail_file(file_, geometry_string, options)
+        created = not thumbnail.exists()
+        if created:
+            source_image = default.engine.get_image(self._source(file_))
+            try:
+                options['image_info'] = default.engine.get_image_info(
+                    source_image)
+                self._create_thumbnail(
+                    source_image, geometry_string, options, thumbnail)
+            finally:
+                default.engine.cleanup(source_image)
+        cache.set(READY_KEY.format(thumbnail.name), True, None)
+        return thumbnail, created
+
+    def get_existing_thumbnail(self, file_, geometry_string, **options):
+        """Готовое превью или None, если его ещё не создали."""
+        if not file_:
+            return None
+        thumbnail = self._thumbnail_file(file_, geometry_string, options)
+        key = READY_KEY.format(thumbnail.name)
+        if not cache.get(key):
+            if not thumbnail.exists():
+                return None
+            cache.set(key, True, None)
+        return thumbnail
+
+    def get_existing_thumbnails(self, items):
+        """
+        Готовые превью для троек (картинка, геометрия, опции), None на
+        месте отсутствующих; отметки готовности читаются одним get_many.
+        """
+        thumbnails = [
+            self._thumbnail_file(file_, geometry, dict(options))
+            if file_ else None
+            for file_, geometry, options in items
+        ]
+        keys = [
+            READY_KEY.format(thumbnail.name)
+            for thumbnail in thumbnails if thumbnail is not None
+        ]
+        ready = cache.get_many(keys)
+        found = []
+        for thumbnail in thumbnails:
+            if thumbnail is not None:
+                key = READY_KEY.format(thumbnail.name)
+                if key not in ready:
+                    if not thumbnail.exists():
+                        thumbnail = None
+                    else:
+                        cache.set(key, True, None)
+            found.append(thumbnail)
+        return found
+
+
+def get_existing_thumbnail(file_, size):
+    """Готовое превью размера ``size`` из settings.POST_THUMBNAILS."""
+    geometry, options = settings.POST_THUMBNAILS[size]
+    return default.backend.get_existing_thumbnail(file_, geometry, **options)
+
+
+def variants(size):
+    """
+    Превью размера ``size`` для srcset: пары (ширина, геометрия) с
+    пропорциями основного размера для каждой ширины из
+    POST_THUMBNAIL_WIDTHS и сам основной размер.
+    """
+    geometry, _ = settings.POST_THUMBNAILS[size]
+    width, height = (int(side) for side in geometry.split('x'))
+    found = {width: geometry}
+    for variant in settings.POST_THUMBNAIL_WIDTHS:
+        found.setdefault(
+            variant, f'{variant}x{round(variant * height / width)}')
+    return sorted(found.items())
+
+
+def get_existing_srcsets(files, size):
+    """
+    Готовые превью размера ``size`` для ``<img srcset>`` у каждой
+    картинки ``files``: словарь с ``src``, ``srcset``, ``width`` и
+    ``height`` или None, если готовых нет. Один get_many на все картинки.
+    """
+    geometry, options = settings.POST_THUMBNAILS[size]
+    widths = variants(size)
+    thumbnails = iter(default.backend.get_existing_thumbnails([
+        (file_, variant, options)
+        for file_ in files for _, variant in widths
+    ]))
+    srcsets = []
+    for _ in files:
+        ready = [
+            (width, variant, thumbnail)
+            for (width, variant), thumbnail in zip(widths, thumbnails)
+            if thumbnail is not None
+        ]
+        if not ready:
+            srcsets.append(None)
+            continue
+        # Основной размер — запасной src для браузеров без srcset.
+        width, variant, thumbnail = next(
+            (item for item in ready if item[1] == geometry), ready[-1])
+        srcsets.append({
+            'src': thumbnail.url,
+            'srcset': ', '.join(
+                f'{item.url} {item_width}w' for item_width, _, item in ready),
+            'width': width,
+            'height': variant.split('x')[1],
+        })
+    return srcsets
+
+
+def get_existing_srcset(file_, size):
+    """Готовые превью одной картинки для srcset (см. get_existing_srcsets)."""
+    return get_existing_srcsets([file_], size)[0]
+
+
+def _source_width(name):
+    with default_storage.open(name) as source, Image.open(source) as image:
+        return image.size[0]
+
+
+def create_thumbnails(name):
+    """
+    Создаёт все превью из settings.POST_THUMBNAILS для картинки ``name``
+    вместе с размерами для srcset; возвращает, сколько файлов появилось.
+    Размеры шире самой картинки не создаются: увеличенная копия не
+    чётче, а весит больше.
+    """
+    source_width = _source_width(name)
+    created = 0
+    for size, (geometry, options) in settings.POST_THUMBNAILS.items():
+        for width, variant in variants(size):
+            if variant != geometry and width > source_width:
+                continue
+            _, new = default.backend.create_thumbnail(
+                name, variant, **options)
+            created += new
+    return created
+
+
+def generate_thumbnails(name):
+    """Задача очереди: превью картинки и обновление страниц с ней."""
+    if create_thumbnails(name):
+        refresh_pages(name)
+
+
+def refresh_pages(name):
+    """
+    Страницы с постами этой картинки, отрисованные с заглушкой, и их
+    ETag устаревают: теги те же, что сбрасывает сохранение поста.
+    """
+    tags = {'feed:index'}
+    for pk, username, slug in Post.objects.filter(image=name).values_list(
+            'pk', 'author__username', 'group__slug'):
+        tags.update((f'post:{pk}', f'author:{username}'))
+        if slug:
+            tags.add(f'group:{slug}')
+    bump_tags(*tags)
+
+
+def schedule_thumbnails(name):
+    """Ставит создание превью в очередь задач, не задерживая запрос."""
+    jobs.enqueue(generate_thumbnails, name, dedup_key=f'thumbnails:{name}')
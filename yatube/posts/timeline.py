@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Follow, Post, TimelineEntry
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты всех подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def recent_posts(author_id, *fields):
+    """Последние посты автора, которыми заполняется лента при подписке."""
+    return Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk',
+    ).values_list(*fields)[:settings.TIMELINE_BACKFILL_SIZE]
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика последние посты нового автора."""
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in recent_posts(author_id, 'pk', 'pub_date')),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты подписчика посты автора, от которого он отписался."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def _subquery(queryset, field):
+    """SQL и параметры выборки одного поля ``queryset`` для ``IN (...)``."""
+    return queryset.order_by().values(field).query.sql_with_params()
+
+
+def _insert_entries(select, params):
+    """INSERT ... SELECT в ленты, пропуская уже существующие записи."""
+    insert = connection.ops.insert_statement(ignore_conflicts=True)
+    suffix = connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{insert} {TimelineEntry._meta.db_table} '
+            f'(user_id, post_id, pub_date) {select} {suffix}',
+            params,
+        )
+
+
+def fan_out_many(posts):
+    """
+    ``fan_out`` для постов из queryset ``posts`` одним INSERT ... SELECT:
+    так ленты дополняются после загрузки постов пачкой.
+    """
+    sql, params = _subquery(posts, 'pk')
+    _insert_entries(
+        'SELECT follow.user_id, post.id, post.pub_date '
+        f'FROM {Follow._meta.db_table} follow '
+        f'JOIN {Post._meta.db_table} post '
+        'ON post.author_id = follow.author_id '
+        f'WHERE post.id IN ({sql})',
+        params,
+    )
+
+
+def backfill_many(follows):
+    """
+    ``backfill`` для подписок из queryset ``follows``. Где есть оконные
+    функции — одним INSERT ... SELECT: последние посты авторов отбирает
+    ROW_NUMBER() по индексу (author, pub_date).
+    """
+    if not connection.features.supports_over_clause:
+        for user_id, author_id in follows.values_list(
+                'user_id', 'author_id').iterator():
+            backfill(user_id, author_id)
+        return
+    follow_sql, follow_params = _subquery(follows, 'pk')
+    author_sql, author_params = _subquery(follows, 'author_id')
+    _insert_entries(
+        'SELECT follow.user_id, post.id, post.pub_date '
+        f'FROM {Follow._meta.db_table} follow JOIN ('
+        '  SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+        '    PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+        '  ) AS position'
+        f'  FROM {Post._meta.db_table} WHERE author_id IN ({author_sql})'
+        ') post ON post.author_id = follow.author_id '
+        f'WHERE follow.id IN ({follow_sql}) AND post.position <= %s '
+        # В порядке индекса (user, pub_date) вставка идёт почти
+        # последовательно, а не вразброс по всему B-дереву.
+        'ORDER BY follow.user_id, post.pub_date',
+        (*author_params, *follow_params, settings.TIMELINE_BACKFILL_SIZE),
+    )
+
+
+@transaction.atomic
+def rebuild():
+    """Пересобирает все ленты подписок из Follow и Post."""
+    TimelineEntry.objects.all().delete()
+    backfill_many(Follow.objects.all())
+
+
+def stale_entries():
+    """Записи лент с постами авторов, на которых больше нет подписки."""
+    return TimelineEntry.objects.annotate(followed=Exists(
+        Follow.objects.filter(
+            user_id=OuterRef('user_id'),
+            author_id=OuterRef('post__author_id'),
+        )
+    )).filter(followed=False)
+
+
+def missing_entries():
+    """
+    Пары (user_id, post_id) из последних постов авторов по подпискам,
+    которых нет в лентах.
+    """
+    for user_id, author_id in Follow.objects.values_list(
+            'user_id', 'author_id').iterator():
+        expected = {pk for pk, in recent_posts(author_id, 'pk')}
+        expected.difference_update(TimelineEntry.objects.filter(
+            user_id=user_id, post_id__in=expected,
+        ).values_list('post_id', flat=True))
+        for post_id in expected:
+            yield user_id, post_id
@@ -1,22 +1,34 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = 'posts'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('search/', views.search, name='search'),
+    path('groups/', views.group_index, name='group_index'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
     path('profile/<str:username>/', views.profile, name='profile'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path(
         'posts/<int:post_id>/comment/',
         views.add_comment,
         name='add_comment'
     ),
     path('follow/', views.follow_index, name='follow_index'),
+    path(
+        'profile/<str:username>/export/',
+        views.profile_export,
+        name='profile_export'
+    ),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
@@ -27,4 +39,16 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('api/v1/posts/', api.index, name='api_index'),
+    path(
+        'api/v1/groups/<slug:slug>/posts/',
+        api.group_posts,
+        name='api_group_posts'
+    ),
+    path(
+        'api/v1/profiles/<str:username>/posts/',
+        api.profile,
+        name='api_profile'
+    ),
+    path('api/v1/posts/<int:post_id>/', api.post_detail, name='api_post'),
 ]
@@ -1,8 +1,305 @@
+import base64
+import binascii
+import json
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+from core.caching import make_etag, tags_digest
+
+from .models import Group, Post, TimelineEntry, User
+
+FEED_COUNT_KEY = 'feed_count:{}'
+# Старые сборки SQLite принимают не больше 999 параметров в запросе.
+IN_CHUNK_SIZE = 500
+
+
+def chunked(values):
+    """Значения кусками, каждый из которых годится для ``__in``."""
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK_SIZE):
+        yield values[start:start + IN_CHUNK_SIZE]
+
+
+def invalidate_feed_counts(*feeds):
+    """Сбрасывает закешированное число постов в перечисленных лентах."""
+    cache.delete_many([FEED_COUNT_KEY.format(feed) for feed in feeds])
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Постраничный вывод по номерам с кешированным COUNT(*) ленты.
+
+    Число постов хранится в кеше по ключу ленты (``index``, ``group:<id>``,
+    ``author:<id>``, ``follow:<id>``) и сбрасывается сигналами при записи
+    постов и подписок. Вместо полного ``page_range`` шаблону отдаётся
+    окно номеров ``elided_page_range`` постоянной длины.
+    """
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, feed=None):
+        super().__init__(object_list, per_page)
+        self.feed = feed
+        self.elided_page_range = []
+
+    @cached_property
+    def count(self):
+        if self.feed is None:
+            return super().count
+        key = FEED_COUNT_KEY.format(self.feed)
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, settings.FEED_COUNT_TIMEOUT)
+        return count
+
+    def page(self, number):
+        page = super().page(number)
+        self.elided_page_range = list(
+            self.get_elided_page_range(page.number))
+        return page
+
+    def get_elided_page_range(self, number, on_each_side=2, on_ends=1):
+        """Номера страниц вокруг текущей и по краям, пропуски — ELLIPSIS."""
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+
+class CursorPaginator(Paginator):
+    """
+    Постраничный вывод по ключу (keyset) вместо COUNT(*) и OFFSET.
+
+    Страница выбирается условием по паре полей ``ordering`` относительно
+    последней (или первой) записи соседней страницы, поэтому глубина
+    листания не влияет на стоимость запроса. Номер страницы здесь
+    относительный: 1 — начало ленты, 2 — любая страница после неё.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk')):
+        super().__init__(object_list.order_by(*ordering), per_page)
+        self.ordering = ordering
+        self.next_cursor = None
+        self.previous_cursor = None
+        self._has_next = False
+        self._has_previous = False
+        self._object_count = 0
+
+    @property
+    def count(self):
+        """Число записей на текущей странице: полный COUNT(*) не считаем."""
+        return self._object_count
+
+    @property
+    def num_pages(self):
+        number = 2 if self._has_previous else 1
+        return number + 1 if self._has_next else number
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def get_page(self, cursor=None):
+        """Возвращает страницу по курсору; битый курсор — первая страница."""
+        position = self._decode(cursor)
+        if position is None:
+            return self._first_page()
+        forward, values = position
+        if forward:
+            return self._page_after(values)
+        return self._page_before(values)
+
+    def _fields(self):
+        return [
+            (name.lstrip('-'), name.startswith('-'))
+            for name in self.ordering
+        ]
+
+    def _order_by(self, forward):
+        if forward:
+            return self.ordering
+        return [
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        ]
 
+    def _keyset_filter(self, values, forward):
+        (first, first_desc), (second, second_desc) = self._fields()
+        first_op = 'lt' if first_desc == forward else 'gt'
+        second_op = 'lt' if second_desc == forward else 'gt'
+        first_value, second_value = values
+        return (
+            Q(**{f'{first}__{first_op}': first_value})
+            | Q(**{first: first_value,
+                   f'{second}__{second_op}': second_value})
+        )
 
-def get_paginator(post_list, request):
-    paginator = Paginator(post_list, settings.AMOUNT_OF_POSTS_TO_DISPLAY)
+    def _fetch(self, values=None, forward=True):
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, forward))
+        queryset = queryset.order_by(*self._order_by(forward))
+        return list(queryset[:self.per_page + 1])
+
+    def _first_page(self):
+        rows = self._fetch()
+        return self._build(rows[:self.per_page], len(rows) > self.per_page,
+                           has_previous=False)
+
+    def _page_after(self, values):
+        rows = self._fetch(values, forward=True)
+        return self._build(rows[:self.per_page], len(rows) > self.per_page,
+                           has_previous=True)
+
+    def _page_before(self, values):
+        rows = self._fetch(values, forward=False)
+        if len(rows) <= self.per_page:
+            # Дошли до начала ленты: показываем полную первую страницу.
+            return self._first_page()
+        rows = rows[:self.per_page][::-1]
+        return self._build(rows, has_next=True, has_previous=True)
+
+    def _build(self, rows, has_next, has_previous):
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._object_count = len(rows)
+        if rows and has_next:
+            self.next_cursor = self._encode(rows[-1], forward=True)
+        if rows and has_previous:
+            self.previous_cursor = self._encode(rows[0], forward=False)
+        return self._get_page(rows, 2 if has_previous else 1, self)
+
+    def _get_field(self, name):
+        opts = self.object_list.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def _encode(self, obj, forward):
+        values = [
+            self._get_field(name).value_to_string(obj)
+            for name, _ in self._fields()
+        ]
+        raw = json.dumps(['n' if forward else 'p', *values])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def _decode(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            direction, *raw = json.loads(
+                base64.urlsafe_b64decode(cursor + padding))
+            values = [
+                self._get_field(name).to_python(value)
+                for (name, _), value in zip(self._fields(), raw)
+            ]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            return None
+        if (direction not in ('n', 'p') or len(raw) != len(self.ordering)
+                or None in values):
+            return None
+        return direction == 'n', values
+
+
+def feed_state(queryset, tags, *extra, feed=None):
+    """
+    ETag ленты: MAX(pub_date) одним запросом по индексу и версии тегов,
+    которые меняются при любой записи постов ленты. С ``feed`` в ETag
+    входит и число постов из кеша счётчиков лент. ``extra`` — то, что
+    зависит от зрителя.
+
+    Last-Modified не отдаётся: правка, удаление поста или отписка не
+    двигают ни одну дату вперёд, и If-Modified-Since дал бы устаревший
+    304. Свежесть решает только ETag.
+    """
+    latest = queryset.aggregate(latest=Max('pub_date'))['latest']
+    count = None
+    if feed is not None:
+        count = CachedCountPaginator(queryset, 1, feed=feed).count
+    return make_etag(latest, count, tags_digest(tags), *extra), None
+
+
+def index_state(*extra, counted=False):
+    return feed_state(Post.objects.all(), ['feed:index'], *extra,
+                      feed='index' if counted else None)
+
+
+def group_state(slug, *extra, counted=False):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is None:
+        return None, None
+    return feed_state(Post.objects.filter(group_id=group_id),
+                      [f'group:{slug}'], *extra,
+                      feed=f'group:{group_id}' if counted else None)
+
+
+def author_state(username, *extra, counted=False):
+    user_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if user_id is None:
+        return None, None
+    return feed_state(Post.objects.filter(author_id=user_id),
+                      [f'author:{username}'], *extra,
+                      feed=f'author:{user_id}' if counted else None)
+
+
+def follow_state(user, *extra):
+    # Отписка не меняет теги, но сбрасывает счётчик ленты подписок;
+    # правки постов в ней видны только по тегу общей ленты.
+    return feed_state(TimelineEntry.objects.filter(user=user),
+                      ['feed:index'], *extra, feed=f'follow:{user.pk}')
+
+
+def post_state(post_id, *extra, user=None):
+    """
+    ETag страницы поста; с ``user`` — и его право правки. Last-Modified,
+    как и у лент, нет: удаление комментария его бы не сдвинуло.
+    """
+    post = Post.objects.filter(pk=post_id).values_list(
+        'pub_date', 'comments_count', 'author_id').first()
+    if post is None:
+        return None, None
+    pub_date, comments_count, author_id = post
+    if user is not None:
+        extra += (user.pk, author_id == user.pk)
+    return make_etag(pub_date, comments_count,
+                     tags_digest([f'post:{post_id}']), *extra), None
+
+
+def get_paginator(post_list, request, feed=None):
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None:
+        # Старые ссылки вида ?page=N продолжают работать.
+        paginator = CachedCountPaginator(
+            post_list, settings.AMOUNT_OF_POSTS_TO_DISPLAY, feed=feed)
+        return paginator.get_page(page_number)
+    paginator = CursorPaginator(post_list, settings.AMOUNT_OF_POSTS_TO_DISPLAY)
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def get_comments_page(post, request):
+    """Страница комментариев поста по курсору ``?comments=``."""
+    paginator = CursorPaginator(
+        post.comments.select_related('author'),
+        settings.COMMENTS_PER_PAGE,
+        ordering=('created', 'pk'),
+    )
+    return paginator.get_page(request.GET.get('comments'))
@@ -1,26 +1,112 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from core.caching import cache_page_tagged, conditional, tags_digest
+from core.db import write_queue
+from core.ratelimit import ratelimit
+
+from . import suggestions
+from .export import jsonl_stream, zip_stream
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
-from .utils import get_paginator
+from .models import Follow, Group, Post, TimelineEntry, User
+from .search import SearchResults
+from .utils import (CachedCountPaginator, author_state, follow_state,
+                    get_comments_page, get_paginator, group_state,
+                    post_state)
+
 
+def post_detail_tags(request, post_id):
+    author = Post.objects.filter(pk=post_id).values_list(
+        'author__username', flat=True).first()
+    return [f'post:{post_id}', f'author:{author}']
 
-@cache_page(20, key_prefix='index_page')
+
+@cache_page_tagged(
+    settings.VIEW_CACHE_TIMEOUT, lambda request: ['feed:index'])
 def index(request):
     post_list = Post.objects.select_related('author', 'group').all()
-    page_obj = get_paginator(post_list, request)
+    page_obj = get_paginator(post_list, request, feed='index')
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+# Выдача поиска не кешируется: каждый новый запрос ``q`` был бы
+# отдельной записью в общем кеше, а искать и так помогает индекс FTS.
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        paginator = CachedCountPaginator(
+            SearchResults(query), settings.AMOUNT_OF_POSTS_TO_DISPLAY)
+        page_obj = paginator.get_page(request.GET.get('page'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+# Страница зависит от зрителя: шапка показывает вход, профиль — кнопку
+# подписки, пост — ссылку на правку и форму комментария с CSRF-токеном.
+# Тело под ETag берётся из кеша страниц с тем же зрителем в ключе:
+# пользователем, а для поста и CSRF-кукой; подписка меняет тег автора.
+def profile_page_state(request, username):
+    following = (
+        request.user.is_authenticated
+        and Follow.objects.filter(
+            author__username=username, user=request.user).exists())
+    return author_state(username, request.user.pk, following,
+                        tags_digest(own_suggestions_tags(request, username)))
+
+
+def own_suggestions_tags(request, username):
+    """Рекомендации видны только в собственном профиле."""
+    if request.user.username != username:
+        return []
+    return [suggestions.SUGGESTIONS_TAG.format(request.user.pk)]
+
+
+def profile_tags(request, username):
+    return [f'author:{username}', *own_suggestions_tags(request, username)]
+
+
+def post_page_state(request, post_id):
+    # get_token() выдаёт куки, если её ещё нет, и ETag сразу учитывает
+    # то значение, с которым браузер придёт в следующий раз.
+    get_token(request)
+    return post_state(
+        post_id, request.META['CSRF_COOKIE'], user=request.user)
+
+
+# Каталог читает хранимые счётчики групп: один запрос на страницу
+# независимо от числа постов. Тег groups сбрасывают записи постов и групп.
+@cache_page_tagged(settings.VIEW_CACHE_TIMEOUT, lambda request: ['groups'])
+def group_index(request):
+    groups = Group.objects.only(
+        'title', 'slug', 'posts_count', 'last_post_at').order_by('title', 'pk')
+    paginator = CachedCountPaginator(
+        groups, settings.GROUPS_PER_PAGE, feed='groups')
+    context = {
+        'page_obj': paginator.get_page(request.GET.get('page')),
+    }
+    return render(request, 'posts/group_index.html', context)
+
+
+@conditional(lambda request, slug: group_state(slug, request.user.pk))
+@cache_page_tagged(
+    settings.VIEW_CACHE_TIMEOUT, lambda request, slug: [f'group:{slug}'])
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts_list = group.posts.all()
-    page_obj = get_paginator(posts_list, request)
+    posts_list = group.posts.select_related('author', 'group')
+    page_obj = get_paginator(posts_list, request, feed=f'group:{group.pk}')
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -28,30 +114,38 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional(profile_page_state)
+@cache_page_tagged(settings.VIEW_CACHE_TIMEOUT, profile_tags)
 def profile(request, username):
-    user_obj = get_object_or_404(User, username=username)
-    all_post_user = user_obj.posts.all()
-    page_obj = get_paginator(all_post_user, request)
-    number_of_subscribers = Follow.objects.filter(author=user_obj).count()
+    user_obj = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    page_obj = get_paginator(
+        user_obj.posts.select_related('author', 'group'), request,
+        feed=f'author:{user_obj.pk}')
     following = (
         request.user.is_authenticated
         and Follow.objects.filter(
             author=user_obj, user=request.user).exists())
     context = {
         'user_obj': user_obj,
-        'all_post_user': all_post_user,
         'page_obj': page_obj,
         'following': following,
-        'number_of_subscribers': number_of_subscribers,
+        'suggestions': (
+            suggestions.for_user(request.user)
+            if user_obj == request.user else []),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@conditional(post_page_state)
+@cache_page_tagged(
+    settings.VIEW_CACHE_TIMEOUT, post_detail_tags, vary_on_csrf=True)
 def post_detail(request, post_id):
     form = CommentForm()
     is_edit = False
-    one_post = get_object_or_404(Post, pk=post_id)
-    comments = one_post.comments.all()
+    one_post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id)
+    comments = get_comments_page(one_post, request)
     if one_post.author == request.user:
         is_edit = True
     context = {
@@ -63,7 +157,21 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@cache_page_tagged(
+    settings.VIEW_CACHE_TIMEOUT,
+    lambda request, post_id: [f'post:{post_id}'])
+def post_comments(request, post_id):
+    """Фрагмент со следующей страницей комментариев для «Показать ещё»."""
+    one_post = get_object_or_404(Post, pk=post_id)
+    context = {
+        'one_post': one_post,
+        'comments': get_comments_page(one_post, request),
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
 @login_required
+@ratelimit('posts:post_create')
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -73,7 +181,8 @@ def post_create(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
+            with write_queue():
+                post.save()
             return redirect('posts:profile', request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -90,8 +199,9 @@ def post_edit(request, post_id):
         instance=post)
     if form.is_valid():
         post = form.save(commit=False)
-        post.author = request.user
-        post.save()
+        # Только поля формы: счётчик комментариев, прочитанный в начале
+        # запроса, не должен затереть параллельные F()-обновления.
+        post.save(update_fields=[*PostForm.Meta.fields, 'updated_at'])
         return redirect('posts:post_detail', post_id=post_id)
     return render(request, 'posts/create_post.html', {
         'form': form,
@@ -101,6 +211,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@ratelimit('posts:add_comment')
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
@@ -108,21 +219,46 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with write_queue():
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
+@conditional(lambda request: follow_state(request.user, tags_digest(
+    [suggestions.SUGGESTIONS_TAG.format(request.user.pk)])))
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_paginator(post_list, request)
+    entries = TimelineEntry.objects.filter(
+        user=request.user).select_related('post__author', 'post__group')
+    page_obj = get_paginator(
+        entries, request, feed=f'follow:{request.user.pk}')
+    page_obj.object_list = [entry.post for entry in page_obj]
     context = {
         'page_obj': page_obj,
+        'suggestions': suggestions.for_user(request.user),
     }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+def profile_export(request, username):
+    """Архив своих данных: ZIP с картинками или ?format=jsonl без них."""
+    if request.user.username != username:
+        raise Http404
+    if request.GET.get('format') == 'jsonl':
+        response = StreamingHttpResponse(
+            jsonl_stream(request.user), content_type='application/x-ndjson')
+        filename = f'yatube-{username}.jsonl'
+    else:
+        response = StreamingHttpResponse(
+            zip_stream(request.user), content_type='application/zip')
+        filename = f'yatube-{username}.zip'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@ratelimit('posts:profile_follow', methods=None)
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if (Follow.objects.filter(
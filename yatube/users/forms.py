@@ -1,5 +1,10 @@
+from django.contrib.auth import forms as auth_forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+
+from core import jobs
 
 User = get_user_model()
 
@@ -8,3 +13,33 @@ class CreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
         fields = ('first_name', 'last_name', 'username', 'email')
+
+
+def send_email(subject, body, from_email, recipients, html_body=None):
+    """Задача очереди: отправляет уже готовое письмо."""
+    message = EmailMultiAlternatives(subject, body, from_email, recipients)
+    if html_body is not None:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
+
+
+class PasswordResetForm(auth_forms.PasswordResetForm):
+    """
+    Письмо собирается в запросе, а отправляет его воркер очереди: запрос
+    не ждёт почтовый сервер.
+    """
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        subject = ''.join(subject.splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = None
+        if html_email_template_name is not None:
+            html_body = loader.render_to_string(
+                html_email_template_name, context)
+        # Повторные нажатия, пока письмо не ушло, дают одно письмо.
+        jobs.enqueue(
+            send_email, subject, body, from_email, [to_email], html_body,
+            dedup_key=f'password_reset:{to_email}')
@@ -1,9 +1,13 @@
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.generic import CreateView
 
+from core.ratelimit import ratelimit
+
 from .forms import CreationForm
 
 
+@method_decorator(ratelimit('users:signup'), name='dispatch')
 class SignUp(CreateView):
     form_class = CreationForm
 
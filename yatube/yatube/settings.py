@@ -49,10 +49,12 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'posts.apps.PostsConfig',
     'sorl.thumbnail',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.ratelimit.RateLimitMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,22 +62,37 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# debug_toolbar только для разработки; в бою — метрики core.metrics
+if DEBUG:
+    INSTALLED_APPS += ['debug_toolbar']
+    MIDDLEWARE += ['debug_toolbar.middleware.DebugToolbarMiddleware']
+
 # Добавьте IP адреса, при обращении с которых будет доступен DjDT
 
 INTERNAL_IPS = [
     '127.0.0.1',
 ] 
 
+# Доступ к /-/metrics. Проходит запрос с заголовком
+# «Authorization: Bearer <METRICS_TOKEN>» (None — токен не принимается)
+# или с адреса из METRICS_ALLOWED_IPS. Адрес берётся из REMOTE_ADDR и
+# верен, только пока Prometheus подключается к приложению напрямую: за
+# прокси или балансировщиком это адрес прокси, и пускать нужно по токену.
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+# Раз в сколько секунд воркер кладёт свои метрики в общий кеш
+METRICS_FLUSH_INTERVAL = 10
+
 ROOT_URLCONF = 'yatube.urls'
 
 # Путь к директории с шаблонами вынесен в переменную:
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Стандартный движок, дополнительно замеряющий время отрисовки
+        'BACKEND': 'core.metrics.InstrumentedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -101,8 +118,58 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Соединение живёт между запросами: прагмы из SQLITE_PRAGMAS
+        # выполняются один раз на соединение
+        'CONN_MAX_AGE': 60,
+    },
+    # Локальная реплика только для чтения: копия основной базы, которую
+    # обновляет `manage.py sync_replica --interval 5`. В тестах это та же
+    # база, что и default.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+# Алиасы, из которых читают страницы DATABASE_REPLICA_VIEWS. Пусто —
+# всё читается из default; для локальной реплики: ['replica'] после
+# первого sync_replica
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_VIEWS = [
+    'posts:index',
+    'posts:group_index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:api_index',
+    'posts:api_group_posts',
+    'posts:api_profile',
+    'posts:api_post',
+    'about:author',
+    'about:tech',
+]
+# Сколько секунд после записи браузер читает только из default: больше,
+# чем отстаёт реплика
+DATABASE_PIN_COOKIE = 'db_pin'
+DATABASE_PIN_SECONDS = 15
+
+# Прагмы каждого нового соединения с SQLite (core.db): WAL — чтение не
+# мешает записи, busy_timeout — ждать блокировку вместо «database is
+# locked», synchronous=NORMAL — без fsync на каждый коммит в WAL
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 10000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение — в КиБ, то есть 64 МБ на соединение
+    'cache_size': -64 * 1024,
 }
+# Сколько секунд запись поста или комментария ждёт своей очереди в
+# процессе; None — писать без очереди
+SQLITE_WRITE_QUEUE_TIMEOUT = 5
 
 
 # Password validation
@@ -150,6 +217,28 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Setting view.py variables
 AMOUNT_OF_POSTS_TO_DISPLAY = 10
+COMMENTS_PER_PAGE = 20
+GROUPS_PER_PAGE = 50
+# Сколько секунд хранить в кеше число постов ленты для паджинатора
+FEED_COUNT_TIMEOUT = 60 * 60
+# Сколько последних постов автора попадает в ленту при подписке на него
+TIMELINE_BACKFILL_SIZE = 1000
+TIMELINE_BATCH_SIZE = 500
+# Сколько секунд хранить страницы лент; сбрасываются по тегам при записи
+VIEW_CACHE_TIMEOUT = 60 * 5
+# По сколько строк читать из базы при выгрузке данных пользователя
+EXPORT_CHUNK_SIZE = 2000
+
+# Пределы частоты запросов (core.ratelimit): 'user' — на пользователя,
+# 'ip' — на адрес; (запросов, за секунд). 'writes' — все запросы, кроме
+# GET, HEAD и OPTIONS, остальные — представления с @ratelimit
+RATELIMITS = {
+    'writes': {'ip': (120, 60)},
+    'posts:add_comment': {'user': (10, 60), 'ip': (30, 60)},
+    'posts:post_create': {'user': (5, 60), 'ip': (20, 60)},
+    'posts:profile_follow': {'user': (30, 60), 'ip': (60, 60)},
+    'users:signup': {'ip': (5, 60 * 60)},
+}
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -161,12 +250,67 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Очередь фоновых задач core.jobs; выполняет `manage.py run_workers`
+JOB_WORKERS = 4
+# Как часто свободный воркер проверяет очередь, секунд
+JOB_POLL_INTERVAL = 1
+# Через сколько секунд задачу упавшего воркера заберёт другой
+JOB_VISIBILITY_TIMEOUT = 5 * 60
+JOB_MAX_ATTEMPTS = 5
+# Пауза перед первым повтором; каждая следующая вдвое дольше
+JOB_RETRY_DELAY = 10
+JOB_RETRY_MAX_DELAY = 60 * 60
+
 # Имя view-функции, обрабатывающей ошибку 403
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 
+# Превью картинок постов: создают воркеры очереди задач после загрузки,
+# шаблоны берут только готовые (posts.templatetags.post_images)
+THUMBNAIL_BACKEND = 'posts.thumbnails.PregeneratedThumbnailBackend'
+THUMBNAIL_STORAGE = 'posts.thumbnails.ThumbnailStorage'
+# Каталог превью; None — подкаталог thumbnails в MEDIA_ROOT
+THUMBNAIL_ROOT = None
+THUMBNAIL_URL = MEDIA_URL + 'thumbnails/'
+THUMBNAIL_PREFIX = ''
+THUMBNAIL_WORKERS = 2
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+# Ширины превью для srcset: те же пропорции, что у размеров выше
+POST_THUMBNAIL_WIDTHS = (320, 480, 720, 1440)
+# Сколько хранить отрисованную карточку поста (posts.templatetags.post_cards)
+POST_CARD_TIMEOUT = 60 * 60 * 24
+
+# Рекомендации «кого почитать» (команда build_suggestions): сколько
+# хранить на пользователя и за сколько дней вдвое падает вес свежести
+# последнего поста автора
+SUGGESTIONS_PER_USER = 10
+SUGGESTIONS_HALF_LIFE_DAYS = 30
+
+# Загрузки больше этого размера Django пишет во временный файл на диске
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+# Картинки постов: предельный размер файла и число пикселей (защита от
+# «бомб» распаковки), большая сторона после уменьшения, формат и
+# качество пересохранения непрозрачных картинок (JPEG или WEBP)
+POST_IMAGE_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 50_000_000
+POST_IMAGE_MAX_SIZE = 2048
+POST_IMAGE_FORMAT = 'JPEG'
+POST_IMAGE_QUALITY = 85
+# Сохранять ли исходный файл в posts/originals/
+POST_IMAGE_KEEP_ORIGINAL = False
+
+# Кеш в файле SQLite общий для всех воркеров на машине (core.sqlite_cache)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.sqlite_cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'default.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
     }
 }
+# Тесты (manage.py test и pytest) держат кеш во временном каталоге
+TEST_RUNNER = 'core.testing.TestRunner'